@@ -6,11 +6,34 @@
     PyScaffold helps you to put up the scaffold of your new Python project.
     Learn more under: https://pyscaffold.org/
 """
+import os
+import sys
+
 from setuptools import setup
 
+
+def aot_extensions():
+    """
+    Ahead-of-time compiled kernels, only built if the environment variable
+    PYDELTASNOW_AOT is set (see pydeltasnow.aot).
+    """
+    if not os.environ.get("PYDELTASNOW_AOT"):
+        return []
+    from setuptools_scm import get_version
+
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "src"))
+    from pydeltasnow.aot import aot_compiler
+    # the package is not installed yet, stamp the version of the wheel
+    version = get_version(version_scheme="no-guess-dev")
+    return [aot_compiler(version=version).distutils_extension()]
+
+
 if __name__ == "__main__":
     try:
-        setup(use_scm_version={"version_scheme": "no-guess-dev"})
+        setup(
+            use_scm_version={"version_scheme": "no-guess-dev"},
+            ext_modules=aot_extensions(),
+        )
     except:  # noqa
         print(
             "\n\nAn error occurred while building the project, "
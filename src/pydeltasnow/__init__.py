@@ -1,3 +1,9 @@
+"""
+The submodules of pydeltasnow and the functions exported here are imported
+lazily on first access, so that ``import pydeltasnow`` does not import numba
+or pandas.
+"""
+import importlib
 import sys
 
 if sys.version_info[:2] >= (3, 8):
@@ -14,4 +20,30 @@ except PackageNotFoundError:  # pragma: no cover
 finally:
     del version, PackageNotFoundError
 
-from pydeltasnow.main import swe_deltasnow
+# exported attributes and the submodules they are imported from
+_LAZY_ATTRIBUTES = {
+    "Workspace": "core",
+    "cache_info": "jit",
+    "warmup": "jit",
+    "max_layers_deviation": "main",
+    "swe_deltasnow": "main",
+    "swe_deltasnow_array": "model",
+}
+_SUBMODULES = {"aot", "core", "jit", "main", "model", "utils"}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        module = importlib.import_module(f"{__name__}.{_LAZY_ATTRIBUTES[name]}")
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES) | _SUBMODULES)
@@ -0,0 +1,92 @@
+"""
+Persistent on-disk cache for the numba kernels, see :mod:`pydeltasnow.jit`.
+This module is only imported if the kernels are compiled just-in-time.
+"""
+import os
+
+from numba.core.caching import (
+    CompileResultCacheImpl,
+    FunctionCache,
+    _CacheLocator,
+    _SourceFileBackedLocatorMixin,
+    )
+from numba.misc.appdirs import AppDirs
+
+from pydeltasnow import __version__
+
+__author__ = "Johannes Aschauer"
+__copyright__ = "Johannes Aschauer"
+__license__ = "GPL-2.0-or-later"
+
+CACHE_DIR_ENV = "PYDELTASNOW_CACHE_DIR"
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _package_stamp():
+    """
+    Version of the package and modification time and size of all its
+    modules. Kernels call each other across modules, so a change in any
+    module needs to invalidate the cache of all kernels.
+    """
+    stamp = [__version__]
+    for name in sorted(os.listdir(PACKAGE_DIR)):
+        if name.endswith(".py"):
+            st = os.stat(os.path.join(PACKAGE_DIR, name))
+            stamp.append((name, st.st_mtime, st.st_size))
+    return tuple(stamp)
+
+
+def _cache_dirs(py_file):
+    """Candidate cache directories in order of preference."""
+    subpath = _CacheLocator.get_suitable_cache_subpath(py_file)
+    dirs = []
+    for env in [CACHE_DIR_ENV, "NUMBA_CACHE_DIR"]:
+        if os.environ.get(env):
+            dirs.append(os.path.join(os.environ[env], subpath))
+    dirs.append(os.path.join(PACKAGE_DIR, "__pycache__"))
+    user_cache_dir = AppDirs(appname="numba", appauthor=False).user_cache_dir
+    dirs.append(os.path.join(user_cache_dir, subpath))
+    return dirs
+
+
+class _PackageCacheLocator(_SourceFileBackedLocatorMixin, _CacheLocator):
+    """
+    Cache locator for the kernels of pydeltasnow, see
+    :mod:`pydeltasnow.jit`.
+    """
+
+    def __init__(self, py_func, py_file, cache_path):
+        self._py_file = py_file
+        self._lineno = py_func.__code__.co_firstlineno
+        self._cache_path = cache_path
+
+    def get_cache_path(self):
+        return self._cache_path
+
+    def get_source_stamp(self):
+        return _package_stamp()
+
+    @classmethod
+    def from_function(cls, py_func, py_file):
+        if os.path.dirname(os.path.abspath(py_file)) != PACKAGE_DIR:
+            return
+        for cache_path in _cache_dirs(py_file):
+            self = cls(py_func, py_file, cache_path)
+            try:
+                self.ensure_cache_path()
+            except OSError:
+                # not writable, try the next directory
+                continue
+            return self
+
+
+class _PackageCacheImpl(CompileResultCacheImpl):
+    _locator_classes = [_PackageCacheLocator]
+
+
+class PackageFunctionCache(FunctionCache):
+    """
+    Function cache of a kernel dispatcher, stored in the first writable
+    cache directory.
+    """
+    _impl_class = _PackageCacheImpl
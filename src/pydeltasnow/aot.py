@@ -0,0 +1,145 @@
+"""
+Ahead-of-time compilation of the numba kernels into the extension module
+``pydeltasnow._aot``.
+
+The extension module is optional. If it is present, :mod:`pydeltasnow.jit`
+takes the kernels from there and pydeltasnow starts without importing or
+running numba, which is useful for short-lived processes. Build it into the
+installed package with::
+
+    python -m pydeltasnow.aot
+
+or ship it in a wheel by building the wheel with the environment variable
+``PYDELTASNOW_AOT=1`` (needs numba in the build environment)::
+
+    PYDELTASNOW_AOT=1 pip wheel --no-build-isolation .
+
+The extension module contains all kernels with all their declared signatures
+(float64 and float32 snow depths). It is compiled for the host platform and
+needs to be rebuilt whenever the package changes. It exports a stamp of the
+package version and source, :mod:`pydeltasnow.jit` ignores a stale extension
+module and compiles the kernels just-in-time instead.
+"""
+import os
+import subprocess
+import sys
+import warnings
+
+from pydeltasnow import jit
+
+from pydeltasnow import __version__
+
+__author__ = "Johannes Aschauer"
+__copyright__ = "Johannes Aschauer"
+__license__ = "GPL-2.0-or-later"
+
+MODULE_NAME = "_aot"
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _argument_types():
+    """
+    Argument types of the kernels that are compiled ahead-of-time as list of
+    (qualified kernel name, float type, argument types) tuples. These are all
+    kernels with declared signatures (see :mod:`pydeltasnow.jit`) for all of
+    their signatures. The float type is the dtype of the first argument.
+    Arrays are accepted in any layout.
+    """
+    from numba import types
+    from numba.core import sigutils
+
+    argument_types = []
+    for name, signatures in jit.SIGNATURES.items():
+        for signature in signatures:
+            argtypes, _ = sigutils.normalize_signature(signature)
+            argtypes = tuple(
+                t.copy(layout="A") if isinstance(t, types.Array) else t
+                for t in argtypes)
+            float_type = str(getattr(argtypes[0], "dtype", ""))
+            if float_type not in jit.FLOAT_TYPES:
+                float_type = jit.FLOAT_TYPES[0]
+            argument_types.append((name, float_type, argtypes))
+    return argument_types
+
+
+def _constant(value):
+    def constant():
+        return value
+    return constant
+
+
+def aot_compiler(output_dir=PACKAGE_DIR, version=None):
+    """
+    Create the :class:`numba.pycc.CC` compiler of the extension module with
+    all kernels and the stamp of the package source exported.
+
+    Parameters
+    ----------
+    output_dir : str, optional
+        Directory the extension module is written to. The default is the
+        directory of the package.
+    version : str, optional
+        Version of the package the extension module is built for. The default
+        is the version of the imported package.
+
+    Raises
+    ------
+    RuntimeError
+        If the kernels are already taken from an extension module.
+
+    Returns
+    -------
+    cc : :class:`numba.pycc.CC`
+    """
+    if jit.BACKEND != "jit":
+        raise RuntimeError(
+            f"pydeltasnow: set {jit.DISABLE_AOT_ENV}=1 to rebuild the "
+            "ahead-of-time compiled kernels.")
+
+    # make sure all kernels are registered
+    import pydeltasnow.main  # noqa: F401
+    from numba.core.errors import NumbaPendingDeprecationWarning
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", NumbaPendingDeprecationWarning)
+        from numba.pycc import CC
+
+    cc = CC(MODULE_NAME)
+    cc.output_dir = output_dir
+    for name, float_type, argtypes in _argument_types():
+        dispatcher = jit.KERNELS[name]
+        dispatcher.compile(argtypes)
+        signature = dispatcher.overloads[argtypes].signature
+        cc.export(jit.aot_name(dispatcher.py_func, float_type), signature)(
+            dispatcher.py_func)
+    stamp = jit._source_stamp(__version__ if version is None else version)
+    cc.export(jit.AOT_STAMP, "int64()")(_constant(stamp))
+    return cc
+
+
+def build(output_dir=PACKAGE_DIR):
+    """
+    Compile the kernels into the extension module.
+
+    Parameters
+    ----------
+    output_dir : str, optional
+        Directory the extension module is written to. The default is the
+        directory of the package.
+
+    Returns
+    -------
+    path : str
+        Path of the extension module.
+    """
+    cc = aot_compiler(output_dir)
+    cc.compile()
+    return os.path.join(output_dir, cc.output_file)
+
+
+if __name__ == "__main__":
+    if jit.BACKEND != "jit":
+        # an existing extension module is loaded, rebuild with numba
+        env = dict(os.environ, **{jit.DISABLE_AOT_ENV: "1"})
+        sys.exit(subprocess.call(
+            [sys.executable, "-m", "pydeltasnow.aot", *sys.argv[1:]], env=env))
+    print(build(*sys.argv[1:]))
@@ -1,16 +1,21 @@
 """
-Core of the DeltaSNOW model. This module provides the public function 
-:func:`deltasnow_snowpack_evolution` which implements the algorithm of the
-deltaSNOW model with numba but does not validate input data. Users are
-discouraged to use this function and should rather use the 
-:func:`pydeltasnow.main.swe_deltasnow` function instead.
+Core of the DeltaSNOW model. This module provides the public functions 
+:func:`deltasnow_snowpack_evolution` and :func:`deltasnow_layer_evolution`
+which implement the algorithm of the deltaSNOW model with numba but do not
+validate input data. Users are discouraged to use these functions and should
+rather use the :func:`pydeltasnow.main.swe_deltasnow` function instead.
+
+The snowpack is stored as rolling layer vectors: only the state of the current
+timestep and the predicted state of the next timestep are kept in memory.
+Full time by layer matrices are only allocated if the layer history is
+requested with :func:`deltasnow_layer_evolution`.
 
 Significant parts of the code in this module are based on the work of Manuel 
 Theurl: https://github.com/manueltheurl/snow_to_swe
 
 """
 import numpy as np
-from numba import njit
+from pydeltasnow.jit import float_signatures, njit
 
 from pydeltasnow import __version__
 
@@ -20,32 +25,40 @@ __license__ = "GPL-2.0-or-later"
 
 G = 9.81  # gravitational acceleration on earth
 PRECISION = 10e-10  # floating point precision
+N_LAYER_BUFFERS = 13  # number of layer vectors in a Workspace
+
+# events counted by the kernel, the names index the diagnostic counters
+DIAGNOSTICS = (
+    "recompaction_error",  # re-compacted height deviates from observation
+    "scale_excess",  # excess swe of layers above rho_max is redistributed
+    "scale_runoff",  # excess swe can not be redistributed and runs off
+    "saturated_scaling",  # all layers exceed rho_max during scaling
+    "drench_runoff",  # drenched snowpack at rho_max, runoff
+    "max_layers_merge",  # layers merged to comply with max_layers
+)
+RECOMPACTION_ERROR = 0
+SCALE_EXCESS = 1
+SCALE_RUNOFF = 2
+SATURATED_SCALING = 3
+DRENCH_RUNOFF = 4
+MAX_LAYERS_MERGE = 5
+N_DIAGNOSTICS = len(DIAGNOSTICS)
+
+# numba types of the model parameters (rho_max to eta_null) and of the model
+# parameters followed by the resolution in kernel signatures, they have the
+# float type of the snow depth (see jit.float_signatures)
+MODEL_PARAMETER_TYPES = ", ".join(["{float}"] * 7)
+PARAMETER_TYPES = MODEL_PARAMETER_TYPES + ", {float}"
 
 
 @njit
-def _assign_H(
-        h_dd,
-        swe_dd,
-        age_dd,
-        h,
-        swe,
-        age,
-        H,
-        SWE,
-        t,
-        day_tot,
-):
+def _saturation_tolerance(layer, rho_max):
     """
-    Assign snowpack properties of the next timestep.
+    Tolerance of the density of a saturated layer in `layer` (a layer vector)
+    to `rho_max`. This is :data:`PRECISION` for float64 layers, for float32
+    layers it is relaxed to the rounding error of the float32 densities.
     """
-    if t < day_tot:
-        h[:, t + 1] = h_dd
-        swe[:, t + 1] = swe_dd
-        age[:, t + 1] = age_dd
-        H[t + 1] = np.sum(h[:, t + 1])
-        SWE[t + 1] = np.sum(swe[:, t + 1])
-
-    return h, swe, age, H, SWE
+    return max(PRECISION, 8 * rho_max * np.finfo(layer.dtype).eps)
 
 
 @njit
@@ -74,78 +87,75 @@ def _compact_H(
     return h_dd, swe_dd, age_dd, rho_dd
 
 
+@njit
+def _overburden(
+        swe_d,
+        ly,
+        swe_hat_d,
+):
+    """
+    Overburden of every layer, i.e. the SWE of the layer itself and all layers
+    above. Computed as reverse cumulative sum over the `ly` active layers and
+    written to `swe_hat_d`.
+    """
+    swe_hat = 0.
+    for i in range(ly - 1, -1, -1):
+        swe_hat = swe_hat + swe_d[i]
+        swe_hat_d[i] = swe_hat
+    return swe_hat_d
+
+
 @njit
 def _drench_H(
-        t,
+        Hobs_d,
         ly,
-        ly_tot,
-        day_tot,
-        Hobs,
-        h,
-        swe,
-        age,
-        H,
-        SWE,
-        ts,
-        eta_null,
-        k,
-        rho_max
+        h_d,
+        swe_d,
+        H_d,
+        SWE_d,
+        rho_max,
+        diagnostics,
 ):
     """
     Drenching of the snowpack if the observed snowdepth decreased significantly.
+    The layers of the current timestep `h_d` and `swe_d` are modified in place.
+    Returns the new snow height and SWE of the snowpack.
     """
-    Hobs_d = Hobs[t]
-    h_d = h[:, t]
-    swe_d = swe[:, t]
-    age_d = age[:, t]
-
     # distribute mass top-down
     # reversed not working in numba
     for i in range(ly - 1, -1, -1):
         # for i in reversed(range(ly)):
-        if np.sum(np.array([element for j, element in enumerate(h_d) if j != i])) + swe_d[
-            i] / rho_max - Hobs_d >= PRECISION:
+        # snow height of all layers except layer i
+        H_others = H_d - h_d[i]
+        if H_others + swe_d[i] / rho_max - Hobs_d >= PRECISION:
             # layers is densified to rho_max
             h_d[i] = swe_d[i] / rho_max
+            H_d = H_others + h_d[i]
         else:
             # layer is densified as far as possible
             # but doesnt reach rho_max
-            h_d[i] = swe_d[i] / rho_max + np.abs(
-                np.sum(np.array([element for j, element in enumerate(h_d) if j != i])) + swe_d[i] / rho_max - Hobs_d)
+            h_d[i] = swe_d[i] / rho_max + np.abs(H_others + swe_d[i] / rho_max - Hobs_d)
+            H_d = H_others + h_d[i]
             break
 
-    true_false_list = np.ones(ly, dtype="bool")
-    for i, (swe_d_val, h_d_val) in enumerate(zip(swe_d[:ly], h_d[:ly])):
-        true_false_list[i] = rho_max - swe_d_val / h_d_val <= PRECISION
+    tol = _saturation_tolerance(swe_d, rho_max)
+    all_max = True
+    for i in range(ly):
+        if rho_max - swe_d[i] / h_d[i] > tol:
+            all_max = False
+            break
 
-    if np.all(true_false_list):
+    if all_max:
         # no further compaction, runoff
-        scale = Hobs_d / np.sum(h_d)
-        h_d = h_d * scale  # all layers are compressed (and have rho_max) [m]
-        swe_d = swe_d * scale
-
-    h[:, t] = h_d
-    swe[:, t] = swe_d
-    age[:, t] = age_d
-    H[t] = np.sum(h[:, t])
-    SWE[t] = np.sum(swe[:, t])
-
-    # no further compaction possible
-    h_dd, swe_dd, age_dd, rho_dd = _dry_metamorphism(
-        h[:, t],
-        swe[:, t],
-        age[:, t],
-        ly_tot,
-        ly,
-        ts,
-        eta_null,
-        k,
-        rho_max)
+        diagnostics[DRENCH_RUNOFF] += 1
+        scale = Hobs_d / H_d
+        for i in range(ly):
+            h_d[i] = h_d[i] * scale  # all layers are compressed (and have rho_max) [m]
+            swe_d[i] = swe_d[i] * scale
+        H_d = Hobs_d
+        SWE_d = SWE_d * scale
 
-    # set values for next day
-    h, swe, age, H, SWE = _assign_H(h_dd, swe_dd, age_dd, h, swe, age, H, SWE, t, day_tot)
-
-    return h, swe, age, H, SWE, rho_dd
+    return H_d, SWE_d
 
 
 @njit
@@ -153,180 +163,638 @@ def _dry_metamorphism(
         h_d,
         swe_d,
         age_d,
-        ly_tot,
         ly,
         ts,
         eta_null,
         k,
-        rho_max
+        rho_max,
+        h_dd,
+        swe_dd,
+        age_dd,
+        rho_dd,
+        swe_hat_d,
 ):
     """
-    Compaction of dry snowpack. 
+    Compaction of dry snowpack. The compacted layers are written to `h_dd`,
+    `swe_dd`, `age_dd` and `rho_dd`. Returns the snow height of the compacted
+    snowpack.
     """
     # overburden of current day (swe_hat_d)
-    swe_hat_d = np.zeros(ly_tot)
-    for i in range(ly_tot):
-        swe_hat_d[i] = np.sum(swe_d[i:ly_tot])
+    swe_hat_d = _overburden(swe_d, ly, swe_hat_d)
 
-    h_dd = h_d.copy()
-    swe_dd = swe_d.copy()
-    age_dd = age_d.copy()
-    rho_dd = np.zeros(ly_tot)
-
-    for i, (h, swe, swe_hat, age) in enumerate(zip(h_d[:ly], swe_d[:ly], swe_hat_d[:ly], age_d[:ly])):
+    H_dd = 0.
+    for i in range(ly):
         h_dd[i], swe_dd[i], age_dd[i], rho_dd[i] = _compact_H(
-            h,
-            swe,
-            swe_hat,
-            age,
+            h_d[i],
+            swe_d[i],
+            swe_hat_d[i],
+            age_d[i],
             ts,
             eta_null,
             k,
             rho_max
         )
+        H_dd = H_dd + h_dd[i]
 
-    return h_dd, swe_dd, age_dd, rho_dd
+    return H_dd
 
 
 @njit
 def _scale_H(
-        t,
+        Hobs_d,
+        Hobs_dd,
         ly,
-        ly_tot,
-        day_tot,
-        deltaH,
-        Hobs,
-        h,
-        swe,
-        age,
-        H,
-        SWE,
+        h_d,
+        swe_d,
+        SWE_d,
         ts,
-        eta_null,
         k,
         rho_max,
+        h_dd_cor,
+        swe_hat_d,
+        diagnostics,
 ):
     """
     Scale snowpack if the settling was assumed a bit too strong or too weak.
+    Yesterdays layers `h_d` and `swe_d` are re-compacted with an adapted
+    viscosity. The layer heights of today are written to `h_dd_cor`, `swe_d` is
+    modified in place. Returns the snow height and SWE of todays snowpack.
     """
-    Hobs_d = Hobs[t - 1]
-    Hobs_dd = Hobs[t]
-    h_d = h[:, t - 1]
-    swe_d = swe[:, t - 1]
-    age_d = age[:, t]
-
     # todays overburden
-    swe_hat_d = np.zeros(ly_tot)
-    for i in range(ly_tot):
-        swe_hat_d[i] = np.sum(swe_d[i:ly_tot])
+    swe_hat_d = _overburden(swe_d, ly, swe_hat_d)
 
     # analytical solution for layerwise adapted viskosity eta
     # assumption: recompaction ~ linear height change of yesterdays layers (see paper)
-    eta_cor = np.zeros(ly_tot)
-    for i in range(ly_tot):
+    H_dd_cor = 0.
+    for i in range(ly):
         if swe_d[i] == 0. or h_d[i] == 0:
-            eta_cor[i] = 0.
+            eta_cor = 0.
         else:
             rho_d = swe_d[i] / h_d[i]
             x = ts * G * swe_hat_d[i] * np.exp(-k * rho_d)  # yesterday
             P = h_d[i] / Hobs_d  # yesterday
-            eta_cor[i] = Hobs_dd * x * P / (h_d[i] - Hobs_dd * P) if (h_d[i] - Hobs_dd * P) != 0 else np.inf
+            eta_cor = Hobs_dd * x * P / (h_d[i] - Hobs_dd * P) if (h_d[i] - Hobs_dd * P) != 0 else np.inf
 
-    h_dd_cor = np.zeros(ly_tot)
-    for i in range(ly_tot):
-        if h_d[i] == 0 or eta_cor[i] == 0:
+        if h_d[i] == 0 or eta_cor == 0:
             h_dd_cor[i] = 0.
         else:
-            h_dd_cor[i] = h_d[i] / (1 + (swe_hat_d[i] * G * ts) / eta_cor[i] * np.exp(-k * swe_d[i] / h_d[i]))
-    h_dd_cor[np.isnan(h_dd_cor)] = 0
-    H_dd_cor = np.sum(h_dd_cor)
+            h_dd_cor[i] = h_d[i] / (1 + (swe_hat_d[i] * G * ts) / eta_cor * np.exp(-k * swe_d[i] / h_d[i]))
+        if np.isnan(h_dd_cor[i]):
+            h_dd_cor[i] = 0
+        H_dd_cor = H_dd_cor + h_dd_cor[i]
 
     # and check, if Hd.cor is the same as Hobs.d
     if np.abs(H_dd_cor - Hobs_dd) > PRECISION:
-        print("WARNING: error in exponential re-compaction: H.dd.cor-Hobs.dd")
-
-    # which layers exceed rho.max?
-    idx_max_arr = np.zeros(ly_tot, dtype='bool')
-    for i, (swe_e_val, h_dd_cor_val) in enumerate(zip(swe_d, h_dd_cor)):
-        try:
-            idx_max_arr[i] = np.divide(swe_e_val, h_dd_cor_val) - rho_max > PRECISION
-        except:
-            idx_max_arr[i] = False
-    idx_max_arr[np.isnan(idx_max_arr)] = False
-
-    if np.any(idx_max_arr):
-        if np.count_nonzero(idx_max_arr) < ly:
-            # collect excess swe in those layers
-            swe_excess = swe_d[idx_max_arr] - h_dd_cor[idx_max_arr] * rho_max
-
-            # set affected layer(s) to rho.max
-            swe_d[idx_max_arr] = swe_d[idx_max_arr] - swe_excess
-
-            # distribute excess swe to other layers top-down
-            lys = range(ly)
-            lys_non_max = []
-            for e in lys:
-                if e not in np.nonzero(idx_max_arr)[0]:
-                    lys_non_max.append(e)
-
-            i = lys_non_max[-1]
-            swe_excess_all = np.sum(swe_excess)
-
-            while swe_excess_all > 0:
+        diagnostics[RECOMPACTION_ERROR] += 1
+
+    # collect excess swe of the layers that exceed rho.max and set them to
+    # rho.max. The runoff is tracked as well in case all layers exceed
+    # rho.max.
+    n_max = 0
+    i_top = -1  # uppermost layer below rho.max
+    swe_excess_all = 0.
+    SWE_runoff = SWE_d
+    for i in range(ly):
+        if h_dd_cor[i] != 0 and swe_d[i] / h_dd_cor[i] - rho_max > PRECISION:
+            swe_excess = swe_d[i] - h_dd_cor[i] * rho_max
+            swe_d[i] = swe_d[i] - swe_excess
+            swe_excess_all = swe_excess_all + swe_excess
+            SWE_runoff = SWE_runoff - swe_excess
+            n_max = n_max + 1
+        else:
+            i_top = i
+
+    if n_max > 0:
+        if n_max < ly:
+            diagnostics[SCALE_EXCESS] += 1
+            # distribute excess swe to other layers top-down, starting at the
+            # uppermost layer below rho.max
+            for i in range(i_top, -1, -1):
+                if swe_excess_all <= 0:
+                    break
                 # layer tolerates this swe amount to reach rho.max
                 swe_res = h_dd_cor[i] * rho_max - swe_d[i]
                 if swe_res > swe_excess_all:
                     swe_res = swe_excess_all
-
                 swe_d[i] = swe_d[i] + swe_res
                 swe_excess_all = swe_excess_all - swe_res
-                i = i - 1
-                if i < 0 < swe_excess_all:
-                    # runoff
-                    break
+            if swe_excess_all > 0:
+                # runoff
+                diagnostics[SCALE_RUNOFF] += 1
+                SWE_d = SWE_d - swe_excess_all
         else:
-            # if all layers have density > rho.max
-            # remove swe.excess from all layers (-> runoff)
-            # (this sets density to rho.max)
-            swe_excess = swe_d[idx_max_arr] - h_dd_cor[idx_max_arr] * rho_max
-            swe_d[idx_max_arr] = swe_d[idx_max_arr] - swe_excess
-
-    h[:, t] = h_dd_cor
-    swe[:, t] = swe_d
-    age[:, t] = age_d
-    H[t] = np.sum(h[:, t])
-    SWE[t] = np.sum(swe[:, t])
-
-    # compact actual day
-    h_dd, swe_dd, age_dd, rho_dd = _dry_metamorphism(
-        h[:, t],
-        swe[:, t],
-        age[:, t],
-        ly_tot,
+            # all layers have density > rho.max, the excess swe was removed
+            # from all layers (-> runoff, this sets density to rho.max)
+            diagnostics[SATURATED_SCALING] += 1
+            SWE_d = SWE_runoff
+
+    return H_dd_cor, SWE_d
+
+
+@njit(error_model='numpy')
+def _settle_H(
+        h_d,
+        rho_dd,
         ly,
-        ts,
-        eta_null,
-        k,
+        sigma_null,
+        c_ov,
+        k_ov,
         rho_max,
-    )
+):
+    """
+    Settling of the existing layers due to the overburden of fresh snow.
+    Layers at `rho_max` do not settle (division by zero yields epsilon = 0,
+    hence the numpy error model). Returns the snow height of the settled
+    snowpack.
+    """
+    H_d = 0.
+    for i in range(ly):
+        # float32 densities of saturated layers may be rounded above rho_max
+        rho = min(rho_dd[i], rho_max)
+        epsilon = c_ov * sigma_null * np.exp(-k_ov * rho / (rho_max - rho))
+        h_d[i] = (1 - epsilon) * h_d[i]
+        H_d = H_d + h_d[i]
+    return H_d
+
 
-    # set values for next day
-    h, swe, age, H, SWE = _assign_H(
+@njit
+def _merge_saturated(
+        ly,
+        h_d,
+        swe_d,
+        age_d,
         h_dd,
         swe_dd,
         age_dd,
-        h,
-        swe,
-        age,
-        H,
-        SWE,
-        t,
-        day_tot,
-    )
-    return h, swe, age, H, SWE, rho_dd
+        rho_dd,
+        n_sub,
+        W,
+        w,
+        rho_max,
+):
+    """
+    Merge adjacent layers that reached `rho_max` in the current as well as in
+    the predicted state into one aggregate layer. Returns the new number of
+    layers.
+
+    Saturated layers are only scaled proportionally by the model, an
+    aggregate layer therefore evolves like its sublayers. The sublayers of
+    layer i are stored as weights `w` of the original layer positions, layer i
+    consists of ``n_sub[i]`` sublayers with the share ``w[p] / W[i]`` each.
+    When two aggregates are merged, the weights of the one with less
+    sublayers are rescaled.
+    """
+    tol = _saturation_tolerance(rho_dd, rho_max)
+    j = 0  # index the current layer is written to
+    pos = 0  # position of the first sublayer of layer i
+    last_saturated = False
+    for i in range(ly):
+        n_i = n_sub[i]
+        saturated = (rho_max - rho_dd[i] <= tol
+                     and rho_max - swe_d[i] / h_d[i] <= tol)
+        if saturated and last_saturated:
+            a = j - 1
+            c_a = swe_dd[a] / W[a]
+            c_i = swe_dd[i] / W[i]
+            if n_sub[a] >= n_i:
+                f = c_i / c_a
+                for p in range(pos, pos + n_i):
+                    w[p] = w[p] * f
+                W[a] = W[a] + W[i] * f
+            else:
+                f = c_a / c_i
+                for p in range(pos - n_sub[a], pos):
+                    w[p] = w[p] * f
+                W[a] = W[i] + W[a] * f
+            n_sub[a] = n_sub[a] + n_i
+            h_d[a] = h_d[a] + h_d[i]
+            swe_d[a] = swe_d[a] + swe_d[i]
+            h_dd[a] = h_dd[a] + h_dd[i]
+            swe_dd[a] = swe_dd[a] + swe_dd[i]
+        else:
+            if j != i:
+                h_d[j] = h_d[i]
+                swe_d[j] = swe_d[i]
+                age_d[j] = age_d[i]
+                h_dd[j] = h_dd[i]
+                swe_dd[j] = swe_dd[i]
+                age_dd[j] = age_dd[i]
+                rho_dd[j] = rho_dd[i]
+                n_sub[j] = n_i
+                W[j] = W[i]
+            j = j + 1
+            last_saturated = saturated
+        pos = pos + n_i
+    return j
 
 
 @njit
+def _split_unsaturated(
+        ly,
+        n_orig,
+        h_d,
+        swe_d,
+        age_d,
+        n_sub,
+        W,
+        w,
+        rho_max,
+):
+    """
+    Split aggregate layers that fell below `rho_max` back into their
+    sublayers (see :func:`_merge_saturated`). Sublayers inherit the age of
+    the aggregate. Returns the new number of layers.
+    """
+    tol = _saturation_tolerance(swe_d, rho_max)
+    new_ly = ly
+    for i in range(ly):
+        if n_sub[i] > 1 and rho_max - swe_d[i] / h_d[i] > tol:
+            new_ly = new_ly + n_sub[i] - 1
+    if new_ly == ly:
+        return ly
+
+    # fill top-down, layers are only moved upwards
+    j = new_ly - 1
+    pos = n_orig
+    for i in range(ly - 1, -1, -1):
+        n_i = n_sub[i]
+        pos = pos - n_i
+        if n_i > 1 and rho_max - swe_d[i] / h_d[i] > tol:
+            h_i = h_d[i]
+            swe_i = swe_d[i]
+            age_i = age_d[i]
+            W_i = W[i]
+            for p in range(pos + n_i - 1, pos - 1, -1):
+                frac = w[p] / W_i
+                h_d[j] = frac * h_i
+                swe_d[j] = frac * swe_i
+                age_d[j] = age_i
+                n_sub[j] = 1
+                W[j] = w[p]
+                j = j - 1
+        else:
+            h_d[j] = h_d[i]
+            swe_d[j] = swe_d[i]
+            age_d[j] = age_d[i]
+            n_sub[j] = n_i
+            W[j] = W[i]
+            j = j - 1
+    return new_ly
+
+
+@njit
+def _merge_most_similar(
+        ly,
+        h_d,
+        swe_d,
+        age_d,
+):
+    """
+    Merge the two adjacent layers with the most similar density into one
+    layer. Of equally similar pairs, the oldest one is merged. The merged
+    layer keeps the age of the older layer. Returns the new number of layers.
+    """
+    i_min = 0
+    d_min = np.inf
+    rho_upper = swe_d[0] / h_d[0]
+    for i in range(ly - 1):
+        rho_lower = rho_upper
+        rho_upper = swe_d[i + 1] / h_d[i + 1]
+        d = np.abs(rho_upper - rho_lower)
+        if d < d_min:
+            d_min = d
+            i_min = i
+
+    h_d[i_min] = h_d[i_min] + h_d[i_min + 1]
+    swe_d[i_min] = swe_d[i_min] + swe_d[i_min + 1]
+    age_d[i_min] = max(age_d[i_min], age_d[i_min + 1])
+    for i in range(i_min + 1, ly - 1):
+        h_d[i] = h_d[i + 1]
+        swe_d[i] = swe_d[i + 1]
+        age_d[i] = age_d[i + 1]
+    return ly - 1
+
+
+@njit(float_signatures(
+    "({float}[::1], " + PARAMETER_TYPES + ", {float}[::1], {float}[:, ::1], "
+    "int64[::1], {float}[::1], {float}[:, ::1], {float}[:, ::1], "
+    "{float}[:, ::1], boolean, boolean, int64, int64[::1])"))
+def _snowpack_evolution(
+        Hobs,
+        rho_max,
+        rho_null,
+        c_ov,
+        k_ov,
+        k,
+        tau,
+        eta_null,
+        resolution,
+        SWE,
+        layers,
+        counts,
+        H_hist,
+        h_hist,
+        swe_hist,
+        age_hist,
+        record_layers,
+        coalesce_saturated,
+        max_layers,
+        diagnostics,
+):
+    """
+    Main loop of the deltaSNOW model on rolling layer vectors.
+
+    Writes modeled SWE to `SWE`. The layer vectors are rows of the workspace
+    buffers `layers` and `counts` (see :class:`Workspace`), which need
+    to hold at least ``np.count_nonzero(Hobs)`` layers (or ``max_layers + 1``
+    layers if the layer count is bounded). If `record_layers` is True,
+    the modeled snow height and the layer state of every timestep are
+    additionally stored in `H_hist` and the days X layers matrices `h_hist`,
+    `swe_hist` and `age_hist`. The matrices are stored time-major so that the
+    layers of a timestep are contiguous in memory.
+
+    All work within a timestep is restricted to the `ly` layers that currently
+    exist, the snow height and SWE of the snowpack are carried along as
+    running totals.
+
+    If `coalesce_saturated` is True, adjacent layers at `rho_max` are merged
+    into aggregate layers and split again as soon as they fall below
+    `rho_max`. This reduces the number of layers without changing the
+    modeled SWE (apart from floating point rounding). Layer ages are not
+    tracked exactly in this mode and it can not be combined with
+    `record_layers`.
+
+    If `max_layers` is positive, the two adjacent layers with the most
+    similar density are merged whenever a new layer would exceed
+    `max_layers` layers (see :func:`_merge_most_similar`). This bounds the
+    work per timestep but changes the modeled SWE. It can not be combined
+    with `coalesce_saturated`.
+
+    Events like runoff are counted in the integer array `diagnostics`, which
+    is indexed by the names in :data:`DIAGNOSTICS`.
+
+    All float arrays have the dtype of `Hobs`. With float32 arrays, the
+    arithmetic within a timestep is still carried out in float64, only the
+    stored state is rounded to float32.
+    """
+    day_tot = len(Hobs)  # total days from first to last snowfall [-]
+
+    # layers of the current timestep
+    h_d = layers[0]  # modeled height of snow in all layers [m]
+    swe_d = layers[1]  # modeled swe in all layers [kg/m2]
+    age_d = layers[2]  # age in all layers
+    # layers of the previous timestep
+    h_y = layers[3]
+    swe_y = layers[4]
+    age_y = layers[5]
+    # layers predicted for the next timestep
+    h_dd = layers[6]
+    swe_dd = layers[7]
+    age_dd = layers[8]
+    # density of the layers predicted for the current timestep
+    rho_dd = layers[9]
+    # overburden
+    swe_hat = layers[10]
+    # sublayers of aggregated saturated layers, see _merge_saturated
+    W = layers[11]
+    w = layers[12]
+    n_sub = counts
+    n_orig = 1  # number of layers without aggregation
+
+    H_d = 0.  # modeled total height of snow of the current timestep [m]
+    SWE_d = 0.  # modeled total SWE of the current timestep [kg/m2]
+
+    ly = 1  # layer number [-]
+    ts = resolution * 3600
+
+    for t in range(day_tot):
+        # snowdepth = 0, no snow cover
+        if Hobs[t] == 0:
+            H_d = 0.
+            SWE_d = 0.
+            SWE[t] = 0
+            if record_layers:
+                H_hist[t] = 0
+
+        # there is snow
+        elif Hobs[t] > 0:  # redundant if, cause can snow height be negative?
+            # first snow in/during season
+            if Hobs[t - 1] == 0:
+                ly = 1
+                age_d[ly - 1] = 1
+                h_d[ly - 1] = Hobs[t]
+                H_d = Hobs[t]
+                swe_d[ly - 1] = rho_null * Hobs[t]
+                SWE_d = swe_d[ly - 1]
+                if coalesce_saturated:
+                    n_orig = 1
+                    n_sub[ly - 1] = 1
+                    W[ly - 1] = 1.
+                    w[n_orig - 1] = 1.
+
+            elif Hobs[t - 1] > 0:
+                # H_d is the predicted snow height of the current timestep
+                deltaH = Hobs[t] - H_d
+                if deltaH > tau:
+                    sigma_null = deltaH * rho_null * G
+                    H_d = _settle_H(
+                        h_d,
+                        rho_dd,
+                        ly,
+                        sigma_null,
+                        c_ov,
+                        k_ov,
+                        rho_max,
+                    )
+                    # swe is not changed by the compaction of the previous
+                    # timestep, swe_d is equal to swe_y.
+                    for i in range(ly):
+                        age_d[i] = age_y[i] + 1
+
+                    # only for new layer
+                    ly = ly + 1
+                    h_d[ly - 1] = Hobs[t] - H_d
+                    swe_d[ly - 1] = rho_null * h_d[ly - 1]
+                    age_d[ly - 1] = 1
+                    if coalesce_saturated:
+                        n_orig = n_orig + 1
+                        n_sub[ly - 1] = 1
+                        W[ly - 1] = 1.
+                        w[n_orig - 1] = 1.
+
+                    # update totals
+                    H_d = H_d + h_d[ly - 1]
+                    SWE_d = SWE_d + swe_d[ly - 1]
+
+                    if 0 < max_layers < ly:
+                        ly = _merge_most_similar(ly, h_d, swe_d, age_d)
+                        diagnostics[MAX_LAYERS_MERGE] += 1
+
+                # no mass gain or loss, but scaling
+                elif -tau <= deltaH <= tau:
+                    # yesterdays layers are re-compacted, swe_d is equal to
+                    # swe_y and gets redistributed in place.
+                    H_d, SWE_d = _scale_H(
+                        Hobs[t - 1],
+                        Hobs[t],
+                        ly,
+                        h_y,
+                        swe_d,
+                        SWE_d,
+                        ts,
+                        k,
+                        rho_max,
+                        h_d,
+                        swe_hat,
+                        diagnostics,
+                    )
+
+                elif deltaH < -tau:
+                    H_d, SWE_d = _drench_H(
+                        Hobs[t],
+                        ly,
+                        h_d,
+                        swe_d,
+                        H_d,
+                        SWE_d,
+                        rho_max,
+                        diagnostics,
+                    )
+
+                else:
+                    raise RuntimeError("no valid calculated HS deviation.")
+
+                if coalesce_saturated:
+                    ly = _split_unsaturated(
+                        ly,
+                        n_orig,
+                        h_d,
+                        swe_d,
+                        age_d,
+                        n_sub,
+                        W,
+                        w,
+                        rho_max,
+                    )
+
+            SWE[t] = SWE_d
+            if record_layers:
+                H_hist[t] = H_d
+                h_hist[t, :ly] = h_d[:ly]
+                swe_hist[t, :ly] = swe_d[:ly]
+                age_hist[t, :ly] = age_d[:ly]
+
+            # compact actual day
+            H_d = _dry_metamorphism(
+                h_d,
+                swe_d,
+                age_d,
+                ly,
+                ts,
+                eta_null,
+                k,
+                rho_max,
+                h_dd,
+                swe_dd,
+                age_dd,
+                rho_dd,
+                swe_hat,
+            )
+
+            if coalesce_saturated:
+                ly = _merge_saturated(
+                    ly,
+                    h_d,
+                    swe_d,
+                    age_d,
+                    h_dd,
+                    swe_dd,
+                    age_dd,
+                    rho_dd,
+                    n_sub,
+                    W,
+                    w,
+                    rho_max,
+                )
+
+            # set values for next day, the buffers of the previous timestep
+            # are reused for the next prediction.
+            h_y, h_d, h_dd = h_d, h_dd, h_y
+            swe_y, swe_d, swe_dd = swe_d, swe_dd, swe_y
+            age_y, age_d, age_dd = age_d, age_dd, age_y
+
+    return SWE
+
+
+class Workspace:
+    """
+    Preallocated buffers for the layer vectors of the deltaSNOW kernel.
+
+    A workspace can be reused for any number of seasons and calls of
+    :func:`pydeltasnow.main.swe_deltasnow`. Its buffers are only reallocated
+    if a season needs more layers than the workspace currently provides.
+
+    Parameters
+    ----------
+    n_layers : int, optional
+        Initial number of layers the workspace provides. The default is 0.
+    dtype : str or :class:`numpy.dtype`, optional
+        Float type of the layer vectors, must match the dtype the model is
+        run with. Either float64 or float32. The default is float64.
+
+    Attributes
+    ----------
+    layers : 2D :class:`numpy.ndarray` of floats
+        Layer vectors of the current, previous and next timestep, one per row.
+    counts : 1D :class:`numpy.ndarray` of ints
+        Number of sublayers of aggregated layers.
+    series : 1D :class:`numpy.ndarray` of floats
+        Snow depth of a season converted to [m].
+    """
+
+    def __init__(self, n_layers=0, dtype=np.float64):
+        self.layers = np.zeros((N_LAYER_BUFFERS, n_layers), dtype=dtype)
+        self.counts = np.zeros(n_layers, dtype=np.int64)
+        self.series = np.zeros(0, dtype=dtype)
+
+    @property
+    def dtype(self):
+        """Float type of the layer vectors."""
+        return self.layers.dtype
+
+    @property
+    def n_layers(self):
+        """Number of layers the workspace provides."""
+        return self.layers.shape[1]
+
+    def reserve(self, n_layers, n_steps=0):
+        """
+        Make sure the workspace provides at least `n_layers` layers and a
+        series buffer of at least `n_steps` timesteps.
+
+        Parameters
+        ----------
+        n_layers : int
+            Required number of layers.
+        n_steps : int, optional
+            Required length of the series buffer. The default is 0.
+
+        Returns
+        -------
+        workspace : :class:`Workspace`
+            The workspace itself.
+        """
+        if n_layers > self.n_layers:
+            self.layers = np.zeros((N_LAYER_BUFFERS, n_layers),
+                                   dtype=self.dtype)
+            self.counts = np.zeros(n_layers, dtype=np.int64)
+        if n_steps > len(self.series):
+            self.series = np.zeros(n_steps, dtype=self.dtype)
+        return self
+
+
+@njit(float_signatures(
+    "({float}[::1], " + PARAMETER_TYPES + ", boolean, int64)"))
 def deltasnow_snowpack_evolution(
         Hobs,
         rho_max,
@@ -337,15 +805,23 @@ def deltasnow_snowpack_evolution(
         tau,
         eta_null,
         resolution,
+        coalesce_saturated=False,
+        max_layers=0,
 ):
     """
     This is the main loop in the delta snow model. Should be called on HS chunks
     of consecutive nonzeros.
 
+    Only the layers of the current and the next timestep are kept in memory,
+    memory usage therefore grows linearly with the length of `Hobs`. Use
+    :func:`deltasnow_layer_evolution` if you need the layer history.
+
     Parameters
     ----------
-    Hobs : 1D :class:`numpy.ndarray` of floats 
-        Measured snow height. Needs to be in [m].
+    Hobs : 1D :class:`numpy.ndarray` of float64 or float32
+        Measured snow height. Needs to be in [m]. All returned arrays have the
+        dtype of `Hobs`, pass the parameters with the same float type to
+        use the declared signatures of the kernel.
         Must comply to the following constraints:
             - no nans
             - continuous entries (no missing dates)
@@ -373,6 +849,17 @@ def deltasnow_snowpack_evolution(
         The default is 8523356.
     resolution : float
         Timedelta in hours between snow observations.
+    coalesce_saturated : bool, optional
+        Whether to merge adjacent layers that reached `rho_max` into one
+        aggregate layer. Aggregates are split again as soon as they fall below
+        `rho_max`, the modeled SWE does not change apart from floating point
+        rounding. This can reduce the runtime for long seasons with many
+        saturated layers. The default is False.
+    max_layers : int, optional
+        Upper bound for the number of layers. If a new layer would exceed
+        `max_layers`, the two adjacent layers with the most similar density
+        are merged. This approximates the model and can not be combined with
+        `coalesce_saturated`. The default is 0, which means no bound.
 
     Raises
     ------
@@ -385,153 +872,152 @@ def deltasnow_snowpack_evolution(
         Calculated SWE in [mm]. Same shape as Hobs.
 
     """
-
     ly_tot = np.count_nonzero(Hobs)  # maximum number of layers [-]
+    if max_layers > 0:
+        ly_tot = min(ly_tot, max_layers + 1)
     day_tot = len(Hobs)  # total days from first to last snowfall [-]
 
-    # preallocate output arrays 
-    H = np.zeros(day_tot)  # modeled total height of snow at any day [m]
-    SWE = np.zeros(day_tot)  # modeled total SWE at any day [kg/m2]
+    # preallocate output array
+    SWE = np.zeros(day_tot, Hobs.dtype)  # modeled total SWE at any day [kg/m2]
 
-    # preallocate matrix as days X layers
-    h = np.zeros((ly_tot, day_tot))  # modeled height of snow in all layers [m]
-    swe = np.zeros((ly_tot, day_tot))  # modeled swe in all layers [kg/m2]
-    age = np.zeros((ly_tot, day_tot))  # age in all layers
+    # workspace buffers, see Workspace
+    layers = np.empty((N_LAYER_BUFFERS, ly_tot), Hobs.dtype)
+    counts = np.empty(ly_tot, dtype=np.int64)
 
-    ly = 1  # layer number [-]
-    ts = resolution * 3600
+    # no layer history is kept
+    no_H_hist = np.zeros(0, Hobs.dtype)
+    no_history = np.zeros((0, 0), Hobs.dtype)
 
-    for t in range(day_tot):
-        # snowdepth = 0, no snow cover
-        if Hobs[t] == 0:
-            H[t] = 0
-            SWE[t] = 0
-            h[:, t] = 0
-            swe[:, t] = 0
+    return _snowpack_evolution(
+        Hobs,
+        rho_max,
+        rho_null,
+        c_ov,
+        k_ov,
+        k,
+        tau,
+        eta_null,
+        resolution,
+        SWE,
+        layers,
+        counts,
+        no_H_hist,
+        no_history,
+        no_history,
+        no_history,
+        False,
+        coalesce_saturated,
+        max_layers,
+        np.zeros(N_DIAGNOSTICS, dtype=np.int64),
+    )
 
-        # there is snow
-        elif Hobs[t] > 0:  # redundant if, cause can snow height be negative?
-            # first snow in/during season
-            if Hobs[t - 1] == 0:
-                ly = 1
-                age[ly - 1, t] = 1
-                h[ly - 1, t] = Hobs[t]
-                H[t] = Hobs[t]
-                swe[ly - 1, t] = rho_null * Hobs[t]
-                SWE[t] = swe[ly - 1, t]
-
-                # compact actual day
-                h_dd, swe_dd, age_dd, rho_dd = _dry_metamorphism(
-                    h[:, t],
-                    swe[:, t],
-                    age[:, t],
-                    ly_tot,
-                    ly,
-                    ts,
-                    eta_null,
-                    k,
-                    rho_max,
-                )
 
-                h, swe, age, H, SWE = _assign_H(
-                    h_dd,
-                    swe_dd,
-                    age_dd,
-                    h,
-                    swe,
-                    age,
-                    H,
-                    SWE,
-                    t,
-                    day_tot,
-                )
+@njit(float_signatures("({float}[::1], " + PARAMETER_TYPES + ")"))
+def deltasnow_layer_evolution(
+        Hobs,
+        rho_max,
+        rho_null,
+        c_ov,
+        k_ov,
+        k,
+        tau,
+        eta_null,
+        resolution,
+):
+    """
+    Dense version of :func:`deltasnow_snowpack_evolution` that additionally
+    returns the modeled snow height and the state of every snow layer at every
+    timestep.
 
-            elif Hobs[t - 1] > 0:
-                deltaH = Hobs[t] - H[t]
-                if deltaH > tau:
-                    sigma_null = deltaH * rho_null * G
-                    epsilon = c_ov * sigma_null * np.exp(-k_ov * rho_dd / (rho_max - rho_dd))
-                    h[:, t] = (1 - epsilon) * h[:, t]
-                    swe[:, t] = swe[:, t - 1]
-                    age[:ly, t] = age[:ly, t - 1] + 1
-                    H[t] = np.sum(h[:, t])
-                    SWE[t] = np.sum(swe[:, t])
+    Note that the layer matrices have a size of
+    ``np.count_nonzero(Hobs) * len(Hobs)`` and can get very large for long
+    seasons with high temporal resolution.
 
-                    # only for new layer
-                    ly = ly + 1
-                    h[ly - 1, t] = Hobs[t] - H[t]
-                    swe[ly - 1, t] = rho_null * h[ly - 1, t]
-                    age[ly - 1, t] = 1
-
-                    # recompute
-                    H[t] = np.sum(h[:, t])
-                    SWE[t] = np.sum(swe[:, t])
-
-                    # compact actual day
-                    h_dd, swe_dd, age_dd, rho_dd = _dry_metamorphism(
-                        h[:, t],
-                        swe[:, t],
-                        age[:, t],
-                        ly_tot,
-                        ly,
-                        ts,
-                        eta_null,
-                        k,
-                        rho_max,
-                    )
+    Parameters
+    ----------
+    Hobs : 1D :class:`numpy.ndarray` of float64 or float32
+        Measured snow height. Needs to be in [m]. All returned arrays have the
+        dtype of `Hobs`, pass the parameters with the same float type to
+        use the declared signatures of the kernel.
+        Must comply to the following constraints:
+            - no nans
+            - continuous entries (no missing dates)
+    rho_max : float
+        Maximum density of an individual snow layer produced by the deltasnow 
+        model in [kg/m3].
+    rho_null : float
+        Fresh snow density for a newly created layer [kg/m3].
+    c_ov : float
+        Overburden factor due to fresh snow [-].
+    k_ov : float
+        Defines the impact of the individual layer density on the compaction due
+        to overburden [-].
+    k : float
+        Exponent of the exponential-law compaction [m3/kg].
+    tau : float
+        Uncertainty bound [m].
+    eta_null : float
+        Effective compactive viscosity of snow for "zero-density" [Pa s].
+    resolution : float
+        Timedelta in hours between snow observations.
 
-                    # set values for next day
-                    h, swe, age, H, SWE = _assign_H(
-                        h_dd,
-                        swe_dd,
-                        age_dd,
-                        h,
-                        swe,
-                        age,
-                        H,
-                        SWE,
-                        t,
-                        day_tot,
-                    )
+    Raises
+    ------
+    RuntimeError
+        If the snowpack evolution has somehow gone wrong.
 
-                # no mass gain or loss, but scaling
-                elif -tau <= deltaH <= tau:
-                    h, swe, age, H, SWE, rho_dd = _scale_H(
-                        t,
-                        ly,
-                        ly_tot,
-                        day_tot,
-                        deltaH,
-                        Hobs,
-                        h,
-                        swe,
-                        age,
-                        H,
-                        SWE,
-                        ts,
-                        eta_null,
-                        k,
-                        rho_max,
-                    )
+    Returns
+    -------
+    SWE : 1D :class:`numpy.ndarray` of floats
+        Calculated SWE in [mm]. Same shape as Hobs.
+    H : 1D :class:`numpy.ndarray` of floats
+        Modeled snow height in [m]. Same shape as Hobs.
+    h : 2D :class:`numpy.ndarray` of floats
+        Height of the individual layers in [m] as timesteps X layers matrix.
+    swe : 2D :class:`numpy.ndarray` of floats
+        SWE of the individual layers in [mm] as timesteps X layers matrix.
+    age : 2D :class:`numpy.ndarray` of floats
+        Age of the individual layers in timesteps as timesteps X layers matrix.
 
-                elif deltaH < -tau:
-                    h, swe, age, H, SWE, rho_dd = _drench_H(
-                        t,
-                        ly,
-                        ly_tot,
-                        day_tot,
-                        Hobs,
-                        h,
-                        swe,
-                        age,
-                        H,
-                        SWE,
-                        ts,
-                        eta_null,
-                        k,
-                        rho_max,
-                    )
+    """
+    ly_tot = np.count_nonzero(Hobs)  # maximum number of layers [-]
+    day_tot = len(Hobs)  # total days from first to last snowfall [-]
 
-                else:
-                    raise RuntimeError("no valid calculated HS deviation.")
-    return SWE
+    # preallocate output arrays
+    dtype = Hobs.dtype
+    H = np.zeros(day_tot, dtype)  # modeled total height of snow at any day [m]
+    SWE = np.zeros(day_tot, dtype)  # modeled total SWE at any day [kg/m2]
+
+    # preallocate matrix as days X layers (time-major, the layers of a
+    # timestep are contiguous)
+    h = np.zeros((day_tot, ly_tot), dtype)  # modeled height of snow in all layers [m]
+    swe = np.zeros((day_tot, ly_tot), dtype)  # modeled swe in all layers [kg/m2]
+    age = np.zeros((day_tot, ly_tot), dtype)  # age in all layers
+
+    # workspace buffers, see Workspace
+    layers = np.empty((N_LAYER_BUFFERS, ly_tot), dtype)
+    counts = np.empty(ly_tot, dtype=np.int64)
+
+    _snowpack_evolution(
+        Hobs,
+        rho_max,
+        rho_null,
+        c_ov,
+        k_ov,
+        k,
+        tau,
+        eta_null,
+        resolution,
+        SWE,
+        layers,
+        counts,
+        H,
+        h,
+        swe,
+        age,
+        True,
+        False,
+        0,
+        np.zeros(N_DIAGNOSTICS, dtype=np.int64),
+    )
+    return SWE, H, h, swe, age
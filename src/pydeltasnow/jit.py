@@ -0,0 +1,358 @@
+"""
+Compilation of the numba kernels of pydeltasnow.
+
+All kernels are compiled with the :func:`njit` decorator of this module.
+
+If the package ships the ahead-of-time compiled extension module
+``pydeltasnow._aot`` (see :mod:`pydeltasnow.aot`), the kernels are taken from
+there and numba is not even imported. The extension module is ignored with a
+warning if it was built from another version or source of the package. Set
+the environment variable ``PYDELTASNOW_DISABLE_AOT`` to a non-empty value to
+always compile just-in-time.
+
+Otherwise, the kernels are compiled just-in-time and the compiled machine code
+is stored in an on-disk cache so that new processes do not need to compile
+the kernels again. The cache directory is chosen as follows, the first
+writable directory is used:
+
+    1. The directory in the environment variable ``PYDELTASNOW_CACHE_DIR``.
+    2. The directory in the environment variable ``NUMBA_CACHE_DIR``.
+    3. The ``__pycache__`` directory of the installed package.
+    4. The user-wide numba cache directory (e.g. ``~/.cache/numba``).
+
+Set ``PYDELTASNOW_CACHE_DIR`` before importing pydeltasnow, e.g. to a
+directory shared by the workers of a batch job or if the package is installed
+read-only. The cache of all kernels is invalidated as soon as any module of
+the package changes.
+
+Every kernel can be compiled with different numba options, called engines
+(see :data:`ENGINES`). The "reference" engine has strict IEEE semantics and
+reproduces the original model. The "fast" engine is compiled with fast-math
+flags that allow LLVM to reorder and approximate floating point operations
+(but keep NaN and infinity semantics) and with the numpy error model (no
+division by zero checks). Its results deviate slightly from the reference
+engine. Use
+:func:`engine_kernel` to get the variant of a kernel for an engine. Other
+engines than "reference" are always compiled just-in-time.
+
+Use :func:`cache_info` to check whether the kernels were loaded from the cache
+or compiled.
+
+The public kernels declare the type signatures they are used with (float64
+and float32 snow depths). They are compiled lazily on first use, call
+:func:`warmup` to compile or load all declared signatures up front, e.g.
+before a worker accepts requests.
+
+"""
+import functools
+import hashlib
+import inspect
+import os
+import time
+import types
+import warnings
+
+from pydeltasnow import __version__
+
+__author__ = "Johannes Aschauer"
+__copyright__ = "Johannes Aschauer"
+__license__ = "GPL-2.0-or-later"
+
+DISABLE_AOT_ENV = "PYDELTASNOW_DISABLE_AOT"
+AOT_STAMP = "package_stamp"  # exported by the extension module, see aot.py
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+KERNELS = {}  # all kernels created with njit, by qualified name
+SIGNATURES = {}  # declared argument type signatures, by qualified name
+
+FLOAT_TYPES = ("float64", "float32")  # supported dtypes of snow depth input
+
+# numba options of the engines on top of the options of the kernels
+ENGINES = {
+    "reference": {},
+    # all fast-math flags except "nnan" and "ninf", the kernels rely on
+    # infinite values and NaN checks for layers at rho_max
+    "fast": {
+        "fastmath": {"nsz", "arcp", "contract", "afn", "reassoc"},
+        "error_model": "numpy",
+    },
+}
+
+_DEFINITIONS = {}  # python function and options of all kernels, by name
+_NAMES = {}  # qualified name of all kernels, by id of the kernel
+
+
+def _source_stamp(version=__version__):
+    """
+    Stamp of the package `version` and the source of all modules of the
+    package as positive int64. Unlike the stamp of the on-disk cache, it
+    does not depend on modification times, which are not kept when a wheel
+    is installed.
+    """
+    digest = hashlib.sha256(version.encode())
+    for name in sorted(os.listdir(PACKAGE_DIR)):
+        if name.endswith(".py"):
+            digest.update(name.encode())
+            with open(os.path.join(PACKAGE_DIR, name), "rb") as f:
+                digest.update(f.read())
+    return int.from_bytes(digest.digest()[:8], "little") >> 1
+
+
+def _load_aot():
+    if os.environ.get(DISABLE_AOT_ENV):
+        return None
+    try:
+        from pydeltasnow import _aot
+    except ImportError:
+        return None
+    stamp = getattr(_aot, AOT_STAMP, None)
+    if stamp is None or stamp() != _source_stamp():
+        warnings.warn(
+            "pydeltasnow: the ahead-of-time compiled kernels were built from "
+            "another version of the package and are ignored. Rebuild them "
+            "with 'python -m pydeltasnow.aot'.", RuntimeWarning)
+        return None
+    return _aot
+
+
+_AOT = _load_aot()
+BACKEND = "jit" if _AOT is None else "aot"  # how the kernels are compiled
+
+
+def float_signatures(signature):
+    """
+    Expand the signature template `signature` with the placeholder
+    ``{float}`` to a signature for every float type in :data:`FLOAT_TYPES`.
+    """
+    return [signature.format(float=float_type) for float_type in FLOAT_TYPES]
+
+
+def aot_name(func, float_type=FLOAT_TYPES[0]):
+    """
+    Name of the ahead-of-time compiled version of the kernel `func` for snow
+    depths of `float_type`.
+    """
+    module = func.__module__.rsplit(".", 1)[-1]
+    name = f"{module}__{func.__qualname__}"
+    if float_type != FLOAT_TYPES[0]:
+        name = f"{name}_{float_type}"
+    return name
+
+
+def _aot_kernel(func, compiled):
+    """
+    Wrap the ahead-of-time compiled versions of `func` in the dict `compiled`,
+    which maps float types to functions that only accept positional
+    arguments, such that it can be called like `func`. The version is chosen
+    by the dtype of the first argument.
+    """
+    signature = inspect.signature(func)
+    n_params = len(signature.parameters)
+    default = compiled.get(FLOAT_TYPES[0], next(iter(compiled.values())))
+
+    @functools.wraps(func)
+    def kernel(*args, **kwargs):
+        if kwargs or len(args) != n_params:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            args = bound.args
+        float_type = getattr(getattr(args[0], "dtype", None), "name", None)
+        return compiled.get(float_type, default)(*args)
+
+    kernel.py_func = func
+    return kernel
+
+
+def _jit_kernel(func, options):
+    import numba
+    from pydeltasnow._cache import PackageFunctionCache
+
+    dispatcher = numba.njit(**options)(func)
+    try:
+        dispatcher._cache = PackageFunctionCache(dispatcher.py_func)
+    except RuntimeError:
+        # no writable cache directory
+        pass
+    return dispatcher
+
+
+def njit(*args, signatures=None, **kwargs):
+    """
+    Drop-in replacement for :func:`numba.njit`.
+
+    Can be used as ``@njit``, ``@njit(**options)`` or
+    ``@njit(signatures, **options)``, where `signatures` is a list of numba
+    argument type signatures like ``"(float64[::1], int64)"``. Other than
+    with numba, the signatures are not compiled at decoration time but by
+    :func:`warmup` or on first use. Returns the ahead-of-time
+    compiled kernel if available, otherwise a numba dispatcher with a
+    persistent cache. Kernels that are not part of the ahead-of-time compiled
+    module are only called from other kernels and are returned unchanged if
+    the module is used. The kernel is registered in :data:`KERNELS`.
+    """
+    def decorator(func):
+        name = f"{func.__module__}.{func.__qualname__}"
+        if signatures:
+            SIGNATURES[name] = list(signatures)
+        _DEFINITIONS[name] = (func, kwargs)
+        if _AOT is not None:
+            compiled = {}
+            for float_type in FLOAT_TYPES:
+                function = getattr(_AOT, aot_name(func, float_type), None)
+                if function is not None:
+                    compiled[float_type] = function
+            if not compiled:
+                _NAMES[id(func)] = name
+                return func
+            kernel = _aot_kernel(func, compiled)
+        else:
+            kernel = _jit_kernel(func, kwargs)
+        KERNELS[name] = kernel
+        _NAMES[id(kernel)] = name
+        return kernel
+
+    if len(args) == 1 and callable(args[0]):
+        return decorator(args[0])
+    if args:
+        signatures = args[0]
+    return decorator
+
+
+def _engine_variant(name, engine):
+    """
+    Compile the kernel `name` and all kernels it calls with the options of
+    `engine`. The python function of the kernel is copied with its global
+    references to other kernels replaced by their variants.
+    """
+    variant_name = f"{name}[{engine}]"
+    if variant_name in KERNELS:
+        return KERNELS[variant_name]
+
+    func, options = _DEFINITIONS[name]
+    func_globals = dict(func.__globals__)
+    for global_name in func.__code__.co_names:
+        callee = func_globals.get(global_name)
+        if id(callee) in _NAMES:
+            func_globals[global_name] = _engine_variant(
+                _NAMES[id(callee)], engine)
+    variant = types.FunctionType(
+        func.__code__, func_globals, func.__name__, func.__defaults__,
+        func.__closure__)
+    variant.__kwdefaults__ = func.__kwdefaults__
+    variant.__module__ = func.__module__
+    # the qualified name separates the variants in the on-disk cache
+    variant.__qualname__ = f"{func.__qualname__}__{engine}"
+    variant.__doc__ = func.__doc__
+
+    kernel = _jit_kernel(variant, {**options, **ENGINES[engine]})
+    KERNELS[variant_name] = kernel
+    if name in SIGNATURES:
+        SIGNATURES[variant_name] = SIGNATURES[name]
+    return kernel
+
+
+def engine_kernel(kernel, engine):
+    """
+    Variant of `kernel` compiled with the options of `engine`.
+
+    Parameters
+    ----------
+    kernel : callable
+        A kernel created with :func:`njit`.
+    engine : str
+        One of the keys of :data:`ENGINES`.
+
+    Raises
+    ------
+    ValueError
+        If `engine` is unknown.
+
+    Returns
+    -------
+    kernel : callable
+        The kernel itself for the "reference" engine, otherwise a numba
+        dispatcher that is registered in :data:`KERNELS` as
+        ``"<qualified name>[<engine>]"``.
+    """
+    if engine not in ENGINES:
+        raise ValueError(
+            f"pydeltasnow: engine must be one of {', '.join(ENGINES)}")
+    if engine == "reference":
+        return kernel
+    return _engine_variant(_NAMES[id(kernel)], engine)
+
+
+def cache_info():
+    """
+    Report for every kernel whether it was loaded from the on-disk cache or
+    compiled in the current process.
+
+    Kernels that are only called from other kernels are not touched if the
+    calling kernel was loaded from the cache. If the ahead-of-time compiled
+    kernels are used, nothing is compiled or cached and all counts are zero.
+
+    Returns
+    -------
+    info : dict
+        Maps the qualified kernel name to a dict with the keys
+
+            - ``cache_path``: directory of the cache files or None if the
+              kernel is not cached.
+            - ``cache_hits``: number of signatures loaded from the cache.
+            - ``cache_misses``: number of signatures compiled.
+
+    """
+    info = {}
+    for name, kernel in KERNELS.items():
+        if not hasattr(kernel, "stats"):  # ahead-of-time compiled
+            info[name] = {"cache_path": None, "cache_hits": 0, "cache_misses": 0}
+            continue
+        stats = kernel.stats
+        info[name] = {
+            "cache_path": stats.cache_path,
+            "cache_hits": sum(stats.cache_hits.values()),
+            "cache_misses": sum(stats.cache_misses.values()),
+        }
+    return info
+
+
+def warmup(engines=("reference",)):
+    """
+    Compile or load all kernels for their declared signatures.
+
+    With a warm cache (see :func:`cache_info`) this only loads the compiled
+    kernels from disk. Nothing needs to be done for the "reference" engine if
+    the ahead-of-time compiled kernels are used.
+
+    Parameters
+    ----------
+    engines : sequence of str, optional
+        Engines (see :data:`ENGINES`) to compile the kernels for. The default
+        is the "reference" engine only.
+
+    Returns
+    -------
+    timings : dict
+        Maps the qualified kernel name to the time in seconds it took to
+        compile or load the kernel.
+
+    """
+    import pydeltasnow.main  # noqa: F401, registers all kernels
+
+    names = []
+    for engine in engines:
+        for name in [name for name in SIGNATURES if "[" not in name]:
+            if engine != "reference":
+                engine_kernel(KERNELS[name], engine)
+                name = f"{name}[{engine}]"
+            names.append(name)
+
+    timings = {}
+    for name in names:
+        start = time.perf_counter()
+        kernel = KERNELS[name]
+        if hasattr(kernel, "compile"):  # not ahead-of-time compiled
+            for signature in SIGNATURES[name]:
+                kernel.compile(signature)
+        timings[name] = time.perf_counter() - start
+    return timings
@@ -6,16 +6,9 @@ This module provides the main user interface to the deltaSNOW model with the
 """
 import pandas as pd
 import numpy as np
-from numba import njit
 
-from .core import deltasnow_snowpack_evolution
-
-from .utils import (
-    continuous_timedeltas_in_nonzero_chunks,
-    fill_small_gaps,
-    get_nonzero_chunk_idxs,
-    get_zeropadded_gap_idxs,
-    )
+# UNIT_FACTOR used to be defined here and stays importable from this module
+from .model import UNIT_FACTOR, swe_deltasnow_array  # noqa: F401
 
 from pydeltasnow import __version__
 
@@ -24,120 +17,6 @@ __copyright__ = "Johannes Aschauer"
 __license__ = "GPL-2.0-or-later"
 
 
-UNIT_FACTOR = {
-    'mm': 0.001,
-    'cm': 0.01,
-    'm': 1.0,
-    }
-
-
-def _raise_nans_error_message(
-    ignore_zeropadded_gaps,
-    ignore_zerofollowed_gaps,
-    interpolate_small_gaps,
-    max_gap_length
-):
-    if (any([ignore_zeropadded_gaps, ignore_zerofollowed_gaps])
-            and not interpolate_small_gaps):
-        raise ValueError(("DeltaSNOW: your data contains NaNs surrounded "
-                          "or followed by non-zeros."))
-    elif (any([ignore_zeropadded_gaps, ignore_zerofollowed_gaps])
-            and interpolate_small_gaps):
-        raise ValueError(("DeltaSNOW: your data contains gaps of NaNs "
-                          "that are either:\n"
-                          "    - at the the end or beginning of your series\n"
-                          f"    - longer than {max_gap_length} timesteps and "
-                          "not surrounded or followed by nonzeros\n"
-                          f"    - shorter than {max_gap_length} timestep(s) "
-                          "but with breaks in the date index"))
-    elif (interpolate_small_gaps 
-            and not any([ignore_zeropadded_gaps, ignore_zerofollowed_gaps])):
-        raise ValueError(("DeltaSNOW: your data contains gaps of NaNs "
-                          "that are either:\n"
-                          "    - at the the end or beginning of your series\n"
-                          f"    - longer than {max_gap_length} timestep(s)\n"
-                          f"    - shorter than {max_gap_length} timestep(s) "
-                          "but with breaks in the date index"))
-    else:
-        raise ValueError("DeltaSNOW: snow depth data must not be NaN.")
-
-
-@njit
-def _deltasnow_on_nonzero_chunks(
-    Hobs,
-    swe_out,
-    start_idxs,
-    stop_idxs,
-    rho_max,
-    rho_null,
-    c_ov,
-    k_ov,
-    k,
-    tau,
-    eta_null,
-    resolution,
-):
-    """
-    Model snowpack evolution on chunks of nonzeros in Hobs.
-
-    Parameters
-    ----------
-    Hobs : 1D :class:`numpy.ndarray` of floats
-        Measured snow depth. Needs to be in [m].
-    swe_out : 1D :class:`numpy.ndarray` of floats
-        preallocated swe array where the output is stored to. Same shape as
-        `Hobs`.
-    start_idxs : :class:`numpy.ndarray` of int
-        Start indices of windows with nonzeros in `Hobs`.
-    stop_idxs : :class:`numpy.ndarray` of int
-        Last indices of windows with nonzeros in `Hobs`.
-    rho_max : float, optional
-        Maximum density of an individual snow layer produced by the DeltaSNOW
-        model in [kg/m3], rho_max needs to be positive. The default is 401.2588.
-    rho_null : float, optional
-        Fresh snow density for a newly created layer [kg/m3], `rho_null` needs to
-        be positive. The default is 81.19417.
-    c_ov : float, optional
-        Overburden factor due to fresh snow [-], `c_ov` needs to be positive. The
-        default is 0.0005104722.
-    k_ov : float, optional
-        Defines the impact of the individual layer density on the compaction due
-        to overburden [-], `k_ov` need to be in the range [0,1].
-        The default is 0.37856737.
-    k : float, optional
-        Exponent of the exponential-law compaction [m3/kg], `k` needs to be
-        positive. The default is 0.02993175.
-    tau : float, optional
-        Uncertainty bound [m], `tau` needs to be positive.
-        The default is 0.02362476.
-    eta_null : float, optional
-        Effective compactive viscosity of snow for "zero-density" [Pa s].
-        The default is 8523356.
-    resolution : float
-        Timedelta in hours between snow observations.
-
-    Returns
-    -------
-    swe_out : 1D :class:`numpy.ndarray`
-
-    """
-
-    for start, stop in zip(start_idxs, stop_idxs):
-        swe_out[start:stop] = deltasnow_snowpack_evolution(
-            Hobs[start:stop],
-            rho_max,
-            rho_null,
-            c_ov,
-            k_ov,
-            k,
-            tau,
-            eta_null,
-            resolution,
-            )
-
-    return swe_out
-
-
 def swe_deltasnow(
     data,
     rho_max=401.2588,
@@ -155,6 +34,14 @@ def swe_deltasnow(
     max_gap_length=3,
     interpolation_method='linear',
     output_series_name='swe_deltasnow',
+    workspace=None,
+    coalesce_saturated_layers=False,
+    max_layers=None,
+    return_diagnostics=False,
+    dtype=np.float64,
+    engine="reference",
+    out=None,
+    split_seasons_at_gaps=False,
 ):
     """
     Calculate snow water equivalent from a snow depth timeseries with the
@@ -207,13 +94,58 @@ def swe_deltasnow(
         The maximum gap length of HS data gaps that are interpolated if
         `interpolate_small_gaps` is True.
     interpolation_method : str
-        Interpolation method for the small gaps which is passed to
-        :func:`pandas.Series.interpolate`. See its documentation for valid
-        options. The default is 'linear'.
+        Interpolation method for the small gaps, see
+        :func:`pydeltasnow.utils.fill_small_gaps`. The methods in
+        :data:`pydeltasnow.utils.INTERPOLATION_METHODS` do not need pandas,
+        all others are passed to :func:`pandas.Series.interpolate`. The
+        default is 'linear'.
     output_series_name : str
         The name of the resulting pd.Series. This can be useful if you want to
         add the resulting SWE series to an existing DataFrame and need a
         specific column name. The default is "swe_deltasnow".
+    workspace : :class:`pydeltasnow.core.Workspace`, optional
+        Preallocated buffers for the model. Pass the same workspace to
+        subsequent calls in order to avoid reallocating the buffers for every
+        station. The workspace grows if a series needs more layers than it
+        currently provides. By default, a new workspace is created.
+    coalesce_saturated_layers : bool
+        Whether to merge adjacent snow layers that reached `rho_max` into one
+        aggregate layer. Aggregates are split again into their original
+        layers as soon as they fall below `rho_max`, so the result does not
+        change apart from floating point rounding. This reduces the runtime
+        for long seasons and perennial snow. The default is False.
+    max_layers : int, optional
+        Upper bound for the number of snow layers. Whenever a new layer would
+        exceed `max_layers`, the two adjacent layers with the most similar
+        density are merged. This puts a hard ceiling on the runtime per
+        timestep and the memory of the model, e.g. for long sub-daily series,
+        but the result deviates from the exact model. Use
+        :func:`max_layers_deviation` to quantify the deviation for your data.
+        Can not be combined with `coalesce_saturated_layers`. By default, the
+        number of layers is not bounded.
+    return_diagnostics : bool
+        Whether to additionally return how often the model ran into events
+        like runoff or an imprecise re-compaction. The default is False.
+    dtype : str or :class:`numpy.dtype`
+        Float type the model is run with, either float64 or float32. See
+        :func:`pydeltasnow.model.swe_deltasnow_array`. The default is float64.
+    engine : str in {"reference", "fast"}
+        Whether to use the "reference" engine with strict floating point
+        semantics or the "fast" engine compiled with fast-math optimizations,
+        whose SWE deviates slightly. See
+        :func:`pydeltasnow.model.swe_deltasnow_array`. The default is
+        "reference".
+    out : 1D :class:`numpy.ndarray`, optional
+        Preallocated array the SWE is written to, e.g. a row of a station by
+        time matrix. The returned series is a view of `out`. See
+        :func:`pydeltasnow.model.swe_deltasnow_array`.
+    split_seasons_at_gaps : bool, optional
+        Whether to split seasons at gaps of NaNs that are neither ignored nor
+        interpolated instead of raising an error. The season ends before such
+        a gap and the snowpack is restarted from zero after it, the SWE in
+        the gap is NaN. This keeps long gaps in the middle of a season, e.g.
+        from a sensor failure, from failing a whole station. The default is
+        False.
 
     Raises
     ------
@@ -224,6 +156,21 @@ def swe_deltasnow(
     -------
     swe : :class:`pandas.Series`
         Calculated SWE with the same index as the input data.
+    diagnostics : dict
+        Only returned if `return_diagnostics` is True. Number of timesteps
+        with each of the events in :data:`pydeltasnow.core.DIAGNOSTICS`:
+
+            - ``recompaction_error``: the re-compacted snow height deviates
+              from the observation.
+            - ``scale_excess``: layers exceed `rho_max` when scaling and their
+              excess SWE is redistributed to other layers.
+            - ``scale_runoff``: the excess SWE can not be redistributed and
+              runs off.
+            - ``saturated_scaling``: all layers exceed `rho_max` when scaling,
+              the excess SWE runs off.
+            - ``drench_runoff``: the drenched snowpack is at `rho_max`, SWE
+              runs off.
+            - ``max_layers_merge``: layers are merged due to `max_layers`.
     
     Notes
     -----
@@ -235,17 +182,19 @@ def swe_deltasnow(
           surrounded by NaNs. See below for more information. This behaviour
           can be useful for measurement series that are not continued in summer.
         - The user can specify how to deal with missing values in a measurement
-          series. There are three parameters that control NaN handling:
+          series. There are four parameters that control NaN handling:
             - ``ignore_zeropadded_gaps``
             - ``ignore_zerofollowed_gaps``
             - ``interpolate_small_gaps``
+            - ``split_seasons_at_gaps``
           Note that the runtime efficiency of the model will decrease when one
           or several of these options are turnded on.
         - Accepts as input data only a :class:`pandas.Series` with 
           :class:`pandas.DatetimeIndex` and no dataframe.
         - The time resolution (timestep in R implementation) will be 
           automatically sniffed from the :class:`pandas.DatetimeIndex` of the 
-          input series.
+          input series. It is determined per season, so a series can e.g.
+          switch from daily to hourly observations between two seasons.
         - The user can specify the input and output units of the HS and SWE
           measurement series, respectively.
         - A :class:`pandas.Series` with the dates as pd.DatetimeIndex is
@@ -253,97 +202,85 @@ def swe_deltasnow(
 
     """
 
-    for unit in [hs_input_unit, swe_output_unit]:
-        assert unit in UNIT_FACTOR.keys(), (f"swe.deltasnow: {unit} has to be "
-                                            "in {'mm', 'cm', 'm'}")
-
     if not isinstance(data, pd.Series):
         raise ValueError("DeltaSNOW: data must be pd.Series")
 
     if not isinstance(data.index, pd.DatetimeIndex):
         raise ValueError("DeltaSNOW: data needs pd.DatetimeIndex as index.")
 
-    Hobs = data.mul(UNIT_FACTOR[hs_input_unit]).to_numpy()
-    dates = data.index.to_numpy()
-
-    if ignore_zeropadded_gaps or ignore_zerofollowed_gaps:
-        if ignore_zerofollowed_gaps:
-            zeropadded_gap_idxs = get_zeropadded_gap_idxs(
-                Hobs,
-                require_leading_zero=False)
-        else:  # ignore_zeropadded_gaps with zero in front and back
-            zeropadded_gap_idxs = get_zeropadded_gap_idxs(
-                Hobs,
-                require_leading_zero=True)
-        # replace the found gaps with zeros in Hobs in order to pass subsequent
-        # checks. Nans will be restored after swe calculation.
-        Hobs = np.where(zeropadded_gap_idxs, 0., Hobs)
-
-    if np.any(np.isnan(Hobs)) and interpolate_small_gaps:
-            Hobs = fill_small_gaps(
-                Hobs,
-                dates,
-                max_gap_length,
-                interpolation_method)
-
-    # check for (remaining) missing values.
-    if np.any(np.isnan(Hobs)):
-        _raise_nans_error_message(
-            ignore_zeropadded_gaps,
-            ignore_zerofollowed_gaps,
-            interpolate_small_gaps,
-            max_gap_length,
-        )
-
-    if not np.all(Hobs >= 0):
-        raise ValueError("DeltaSNOW: snow depth data must be positive")
-
-    if not np.all(np.isreal(Hobs)):
-        raise ValueError("DeltaSNOW: snow depth data must be numeric")
-
-    if Hobs[0] != 0:
-        raise ValueError(("DeltaSNOW: snow depth observations must start "
-                          "with 0 or the first non nan entry \nneeds to be "
-                          "zero if you ignore zeropadded or zerofollowed gaps"))
-
-    # start and stop indices of nonzero chunks.
-    start_idxs, stop_idxs = get_nonzero_chunk_idxs(Hobs)
-
-    # check for date continuity.
-    continuous, resolution = continuous_timedeltas_in_nonzero_chunks(
-        dates,
-        start_idxs,
-        stop_idxs)
-    if not continuous:
-        raise ValueError(("DeltaSNOW: date column must be strictly "
-                          "regular within \nchunks of consecutive nonzeros"))
-
-    swe_allocation = np.zeros(len(Hobs))
-
-    swe = _deltasnow_on_nonzero_chunks(
-        Hobs,
-        swe_allocation,
-        start_idxs,
-        stop_idxs,
-        rho_max,
-        rho_null,
-        c_ov,
-        k_ov,
-        k,
-        tau,
-        eta_null,
-        resolution,
+    swe = swe_deltasnow_array(
+        data.to_numpy(),
+        data.index.to_numpy(),
+        rho_max=rho_max,
+        rho_null=rho_null,
+        c_ov=c_ov,
+        k_ov=k_ov,
+        k=k,
+        tau=tau,
+        eta_null=eta_null,
+        hs_input_unit=hs_input_unit,
+        swe_output_unit=swe_output_unit,
+        ignore_zeropadded_gaps=ignore_zeropadded_gaps,
+        ignore_zerofollowed_gaps=ignore_zerofollowed_gaps,
+        interpolate_small_gaps=interpolate_small_gaps,
+        max_gap_length=max_gap_length,
+        interpolation_method=interpolation_method,
+        workspace=workspace,
+        coalesce_saturated_layers=coalesce_saturated_layers,
+        max_layers=max_layers,
+        return_diagnostics=return_diagnostics,
+        dtype=dtype,
+        engine=engine,
+        out=out,
+        split_seasons_at_gaps=split_seasons_at_gaps,
     )
+    if return_diagnostics:
+        swe, diagnostics = swe
 
-    if ignore_zeropadded_gaps or ignore_zerofollowed_gaps:
-        # restore nans in zeropadded gaps.
-        swe = np.where(zeropadded_gap_idxs, np.nan, swe)
-
-    # original R implementation (rewritten in ´.core´) returns SWE in ['mm']
     result = pd.Series(
-        data=swe*0.001/UNIT_FACTOR[swe_output_unit],
+        data=swe,
         index=data.index,
         name=output_series_name,
+        copy=False,
     )
 
+    if return_diagnostics:
+        return result, diagnostics
     return result
+
+
+def max_layers_deviation(data, max_layers, **kwargs):
+    """
+    Largest absolute deviation of the SWE modeled with a bounded number of
+    layers from the SWE of the exact model.
+
+    Parameters
+    ----------
+    data : :class:`pandas.Series` with :class:`pandas.DatetimeIndex`
+        The input snow depth data, see :func:`swe_deltasnow`.
+    max_layers : int
+        Upper bound for the number of snow layers.
+    **kwargs
+        Further keyword arguments passed to :func:`swe_deltasnow`, except
+        `out` and `return_diagnostics`.
+
+    Raises
+    ------
+    ValueError
+        If `out` or `return_diagnostics` is passed.
+
+    Returns
+    -------
+    deviation : float
+        Maximum absolute SWE deviation in `swe_output_unit`.
+
+    """
+    for name in ("out", "return_diagnostics"):
+        if name in kwargs:
+            raise ValueError(
+                f"DeltaSNOW: max_layers_deviation does not accept {name}")
+    swe_exact = swe_deltasnow(data, **kwargs)
+    swe_bounded = swe_deltasnow(data, max_layers=max_layers, **kwargs)
+    diff = np.abs(swe_bounded - swe_exact).to_numpy()
+    # np.nanmax has no initial value before numpy 1.22
+    return float(np.nanmax(diff)) if np.isfinite(diff).any() else 0.
@@ -0,0 +1,587 @@
+"""
+This module provides the interface to the deltaSNOW model on plain numpy
+arrays with the :func:`swe_deltasnow_array` function. It does not depend on
+pandas, :func:`pydeltasnow.main.swe_deltasnow` is a thin
+:class:`pandas.Series` wrapper around it.
+
+"""
+import numpy as np
+
+from .jit import ENGINES, FLOAT_TYPES, engine_kernel, float_signatures, njit
+
+from .core import (
+    DIAGNOSTICS,
+    MODEL_PARAMETER_TYPES,
+    N_DIAGNOSTICS,
+    Workspace,
+    _snowpack_evolution,
+    )
+
+from .utils import (
+    DATES_ERROR,
+    NAN_ERROR,
+    NEGATIVE_ERROR,
+    SEASON_START,
+    SEASON_STEP,
+    SEASON_STOP,
+    START_ERROR,
+    fill_small_gaps,
+    get_zeropadded_gap_idxs,
+    preprocess,
+    )
+
+from pydeltasnow import __version__
+
+__author__ = "Johannes Aschauer"
+__copyright__ = "Johannes Aschauer"
+__license__ = "GPL-2.0-or-later"
+
+
+UNIT_FACTOR = {
+    'mm': 0.001,
+    'cm': 0.01,
+    'm': 1.0,
+    }
+
+
+def _raise_nans_error_message(
+    ignore_zeropadded_gaps,
+    ignore_zerofollowed_gaps,
+    interpolate_small_gaps,
+    max_gap_length
+):
+    if (any([ignore_zeropadded_gaps, ignore_zerofollowed_gaps])
+            and not interpolate_small_gaps):
+        raise ValueError(("DeltaSNOW: your data contains NaNs surrounded "
+                          "or followed by non-zeros."))
+    elif (any([ignore_zeropadded_gaps, ignore_zerofollowed_gaps])
+            and interpolate_small_gaps):
+        raise ValueError(("DeltaSNOW: your data contains gaps of NaNs "
+                          "that are either:\n"
+                          "    - at the the end or beginning of your series\n"
+                          f"    - longer than {max_gap_length} timesteps and "
+                          "not surrounded or followed by nonzeros\n"
+                          f"    - shorter than {max_gap_length} timestep(s) "
+                          "but with breaks in the date index"))
+    elif (interpolate_small_gaps 
+            and not any([ignore_zeropadded_gaps, ignore_zerofollowed_gaps])):
+        raise ValueError(("DeltaSNOW: your data contains gaps of NaNs "
+                          "that are either:\n"
+                          "    - at the the end or beginning of your series\n"
+                          f"    - longer than {max_gap_length} timestep(s)\n"
+                          f"    - shorter than {max_gap_length} timestep(s) "
+                          "but with breaks in the date index"))
+    else:
+        raise ValueError("DeltaSNOW: snow depth data must not be NaN.")
+
+
+def _as_dates(dates, timestamp_unit):
+    """
+    Convert datetime64 or integer epoch timestamps to a datetime64[ns] array.
+    """
+    dates = np.asarray(dates)
+    if np.issubdtype(dates.dtype, np.integer):
+        dates = dates.astype(f"datetime64[{timestamp_unit}]")
+    elif not np.issubdtype(dates.dtype, np.datetime64):
+        raise ValueError(("DeltaSNOW: dates must be datetime64 or integer "
+                          "epoch timestamps"))
+    return np.ascontiguousarray(dates, dtype="datetime64[ns]")
+
+
+def _regular_dates(n, resolution):
+    """
+    Regular datetime64[ns] array of length `n` with `resolution` in hours,
+    starting at the epoch.
+    """
+    step = int(round(resolution * 3600e9))
+    return (np.arange(n, dtype=np.int64) * step).astype("datetime64[ns]")
+
+
+@njit(float_signatures(
+    "({float}[::1], {float}, {float}[::1], {float}, int64[:, ::1], "
+    "int64[:, ::1], " + MODEL_PARAMETER_TYPES + ", {float}[::1], "
+    "{float}[:, ::1], int64[::1], {float}[::1], boolean, int64, int64[::1])"))
+def _deltasnow_on_nonzero_chunks(
+    Hobs,
+    hs_factor,
+    swe_out,
+    swe_factor,
+    seasons,
+    gaps,
+    rho_max,
+    rho_null,
+    c_ov,
+    k_ov,
+    k,
+    tau,
+    eta_null,
+    resolutions,
+    layers,
+    counts,
+    series,
+    coalesce_saturated,
+    max_layers,
+    diagnostics,
+):
+    """
+    Model snowpack evolution on the seasons (chunks of nonzeros) in Hobs.
+
+    All chunks share the same workspace buffers, no arrays are allocated per
+    chunk. The unit conversions are applied chunk by chunk, so no converted
+    copy of the whole series is needed. Every chunk is modeled with its own
+    time resolution.
+
+    Parameters
+    ----------
+    Hobs : 1D :class:`numpy.ndarray` of floats
+        Measured snow depth. Needs to be in [m] after multiplication with
+        `hs_factor`.
+    hs_factor : float
+        Factor that converts `Hobs` to [m].
+    swe_out : 1D :class:`numpy.ndarray` of floats
+        preallocated swe array where the output is stored to. Same shape and
+        dtype as `Hobs`. It is overwritten completely.
+    swe_factor : float
+        Factor that converts the modeled SWE in [mm] to the output unit.
+    seasons : 2D :class:`numpy.ndarray` of int
+        Season table as returned by :func:`pydeltasnow.utils.preprocess`.
+    gaps : 2D :class:`numpy.ndarray` of int
+        Start and stop indices of ignored gaps, which are set to NaN in
+        `swe_out`. A season that starts within a gap (see
+        :func:`pydeltasnow.utils.preprocess`) starts with zero snow depth.
+    rho_max : float, optional
+        Maximum density of an individual snow layer produced by the DeltaSNOW
+        model in [kg/m3], rho_max needs to be positive. The default is 401.2588.
+    rho_null : float, optional
+        Fresh snow density for a newly created layer [kg/m3], `rho_null` needs to
+        be positive. The default is 81.19417.
+    c_ov : float, optional
+        Overburden factor due to fresh snow [-], `c_ov` needs to be positive. The
+        default is 0.0005104722.
+    k_ov : float, optional
+        Defines the impact of the individual layer density on the compaction due
+        to overburden [-], `k_ov` need to be in the range [0,1].
+        The default is 0.37856737.
+    k : float, optional
+        Exponent of the exponential-law compaction [m3/kg], `k` needs to be
+        positive. The default is 0.02993175.
+    tau : float, optional
+        Uncertainty bound [m], `tau` needs to be positive.
+        The default is 0.02362476.
+    eta_null : float, optional
+        Effective compactive viscosity of snow for "zero-density" [Pa s].
+        The default is 8523356.
+    resolutions : 1D :class:`numpy.ndarray` of floats
+        Timedelta in hours between snow observations, one per season.
+    layers : 2D :class:`numpy.ndarray` of floats
+        Layer buffers of a :class:`pydeltasnow.core.Workspace` with the dtype
+        of `Hobs` that provides
+        at least as many layers as the longest chunk has timesteps, or
+        ``max_layers + 1`` layers if the layer count is bounded.
+    counts : 1D :class:`numpy.ndarray` of ints
+        Count buffer of the same :class:`pydeltasnow.core.Workspace`.
+    series : 1D :class:`numpy.ndarray` of floats
+        Series buffer of the same :class:`pydeltasnow.core.Workspace`. Only
+        used if `hs_factor` is not 1 or a season starts within a gap, it then
+        needs to be as long as the longest chunk.
+    coalesce_saturated : bool
+        Whether to merge adjacent layers at `rho_max`.
+    max_layers : int
+        Upper bound for the number of layers, 0 means no bound.
+    diagnostics : 1D :class:`numpy.ndarray` of ints
+        Counters of the events listed in :data:`pydeltasnow.core.DIAGNOSTICS`,
+        accumulated over all chunks.
+
+    Returns
+    -------
+    swe_out : 1D :class:`numpy.ndarray`
+
+    """
+    # no layer history is kept
+    no_H_hist = np.zeros(0, Hobs.dtype)
+    no_history = np.zeros((0, 0), Hobs.dtype)
+
+    swe_out[:] = 0
+
+    for s in range(len(seasons)):
+        start = seasons[s, SEASON_START]
+        stop = seasons[s, SEASON_STOP]
+        if hs_factor == 1 and not np.isnan(Hobs[start]):
+            Hobs_chunk = Hobs[start:stop]
+        else:
+            Hobs_chunk = series[:stop - start]
+            for i in range(stop - start):
+                Hobs_chunk[i] = Hobs[start + i] * hs_factor
+            if np.isnan(Hobs_chunk[0]):
+                # season after a gap that splits seasons, the snowpack
+                # starts from zero at the last NaN of the gap
+                Hobs_chunk[0] = 0
+        swe_chunk = swe_out[start:stop]
+        _snowpack_evolution(
+            Hobs_chunk,
+            rho_max,
+            rho_null,
+            c_ov,
+            k_ov,
+            k,
+            tau,
+            eta_null,
+            resolutions[s],
+            swe_chunk,
+            layers,
+            counts,
+            no_H_hist,
+            no_history,
+            no_history,
+            no_history,
+            False,
+            coalesce_saturated,
+            max_layers,
+            diagnostics,
+            )
+        if swe_factor != 1:
+            for i in range(stop - start):
+                swe_chunk[i] = swe_chunk[i] * swe_factor
+
+    for g in range(len(gaps)):
+        swe_out[gaps[g, 0]:gaps[g, 1]] = np.nan
+
+    return swe_out
+
+
+def swe_deltasnow_array(
+    hs,
+    dates_or_resolution,
+    rho_max=401.2588,
+    rho_null=81.19417,
+    c_ov=0.0005104722,
+    k_ov=0.37856737,
+    k=0.02993175,
+    tau=0.02362476,
+    eta_null=8523356.,
+    hs_input_unit='m',
+    swe_output_unit='mm',
+    ignore_zeropadded_gaps=False,
+    ignore_zerofollowed_gaps=False,
+    interpolate_small_gaps=False,
+    max_gap_length=3,
+    interpolation_method='linear',
+    workspace=None,
+    coalesce_saturated_layers=False,
+    max_layers=None,
+    return_diagnostics=False,
+    timestamp_unit='ns',
+    dtype=np.float64,
+    engine="reference",
+    out=None,
+    split_seasons_at_gaps=False,
+):
+    """
+    Calculate snow water equivalent from a snow depth array with the
+    DeltaSNOW model.
+
+    Works like :func:`pydeltasnow.main.swe_deltasnow` but on numpy arrays.
+
+    Parameters
+    ----------
+    hs : 1D :class:`numpy.ndarray`
+        The input snow depth data. Needs to be numeric and not negative.
+    dates_or_resolution : 1D :class:`numpy.ndarray` or float
+        Either the timestamps of the snow depth observations as
+        :class:`numpy.datetime64` array or as integer epoch timestamps in
+        `timestamp_unit`, or the fixed time resolution of `hs` in hours. The
+        dates need to be regular within every season (chunk of nonzeros) but
+        the resolution can change between seasons.
+    rho_max : float, optional
+        Maximum density of an individual snow layer produced by the DeltaSNOW
+        model in [kg/m3], `rho_max` needs to be positive. The default is 401.2588.
+    rho_null : float, optional
+        Fresh snow density for a newly created layer [kg/m3], `rho_null` needs to
+        be positive. The default is 81.19417.
+    c_ov : float, optional
+        Overburden factor due to fresh snow [-], `c_ov` needs to be positive. The
+        default is 0.0005104722.
+    k_ov : float, optional
+        Defines the impact of the individual layer density on the compaction due
+        to overburden [-], `k_ov` needs to be in the range [0,1].
+        The default is 0.37856737.
+    k : float, optional
+        Exponent of the exponential-law compaction [m3/kg], `k` needs to be
+        positive. The default is 0.02993175.
+    tau : float, optional
+        Uncertainty bound [m], `tau` needs to be positive.
+        The default is 0.02362476.
+    eta_null : float, optional
+        Effective compactive viscosity of snow for "zero-density" [Pa s].
+        The default is 8523356.
+    hs_input_unit : str in {"mm", "cm", "m"}
+        The unit of the input snow depth. The default is "m".
+    swe_output_unit : str in {"mm", "cm", "m"}
+        The unit of the output snow water equivalent. The default is "mm".
+    ignore_zeropadded_gaps : bool
+        Whether to ignore gaps that have leading and trailing zeros. The
+        resulting SWE series will contain NaNs at the same positions. These
+        gaps are also ignored when you use `ignore_zerofollowed_gaps`.
+    ignore_zerofollowed_gaps : bool
+        Less strict rule than `ignore_zeropadded_gaps`. Whether to ignore gaps
+        that have trailing zeros. This can lead to sudden drops in SWE in case
+        missing HS data is present. The resulting SWE series will contain NaNs
+        at the same positions.
+    interpolate_small_gaps : bool
+        Whether to interpolate small gaps in the input HS data or not. Only gaps
+        that are surrounded by data points and have continuous date spacing
+        between the leading and trailing data point are interpolated.
+    max_gap_length : int
+        The maximum gap length of HS data gaps that are interpolated if
+        `interpolate_small_gaps` is True.
+    interpolation_method : str
+        Interpolation method for the small gaps, see
+        :func:`pydeltasnow.utils.fill_small_gaps`. The methods in
+        :data:`pydeltasnow.utils.INTERPOLATION_METHODS` do not need pandas,
+        all others are passed to :func:`pandas.Series.interpolate`. The
+        default is 'linear'.
+    workspace : :class:`pydeltasnow.core.Workspace`, optional
+        Preallocated buffers for the model. Pass the same workspace to
+        subsequent calls in order to avoid reallocating the buffers for every
+        station. The workspace grows if a series needs more layers than it
+        currently provides. By default, a new workspace is created.
+    coalesce_saturated_layers : bool
+        Whether to merge adjacent snow layers that reached `rho_max` into one
+        aggregate layer. Aggregates are split again into their original
+        layers as soon as they fall below `rho_max`, so the result does not
+        change apart from floating point rounding. This reduces the runtime
+        for long seasons and perennial snow. The default is False.
+    max_layers : int, optional
+        Upper bound for the number of snow layers. Whenever a new layer would
+        exceed `max_layers`, the two adjacent layers with the most similar
+        density are merged. This puts a hard ceiling on the runtime per
+        timestep and the memory of the model, e.g. for long sub-daily series,
+        but the result deviates from the exact model. Use
+        :func:`pydeltasnow.main.max_layers_deviation` to quantify the
+        deviation for your data.
+        Can not be combined with `coalesce_saturated_layers`. By default, the
+        number of layers is not bounded.
+    return_diagnostics : bool
+        Whether to additionally return how often the model ran into events
+        like runoff or an imprecise re-compaction. The default is False.
+    timestamp_unit : str
+        Unit of integer epoch timestamps in `dates_or_resolution`, e.g. "s"
+        or "ns". The default is "ns".
+    dtype : str or :class:`numpy.dtype`
+        Float type the model is run with, either float64 or float32. With
+        float32, the snow depth, the modeled SWE and the layer buffers are
+        stored in single precision, which halves the memory footprint of the
+        model. The arithmetic within a timestep is still carried out in
+        float64, so float32 does not run faster than float64. The modeled
+        SWE of the three reference stations in the test suite deviates by
+        less than 0.001 mm from float64, which is the float32 rounding error
+        of SWE values around 1000 mm. A `workspace` must have the same dtype.
+        The default is float64.
+    engine : str in {"reference", "fast"}
+        The "reference" engine reproduces the original model with strict
+        IEEE floating point semantics. The "fast" engine is compiled with
+        fast-math optimizations (see :mod:`pydeltasnow.jit`), its SWE deviates
+        slightly from the reference engine. The default is "reference".
+    out : 1D :class:`numpy.ndarray`, optional
+        Preallocated array the SWE is written to, e.g. a row of a station by
+        time matrix. Needs to be C-contiguous, of type `dtype` and of the
+        shape of `hs`. Apart from the result, a full length copy of `hs` is
+        only made if it has to be converted to `dtype` or if gaps are ignored
+        or interpolated.
+    split_seasons_at_gaps : bool, optional
+        Whether to split seasons at gaps of NaNs that are neither ignored nor
+        interpolated instead of raising an error. The season ends before such
+        a gap and the snowpack is restarted from zero after it, the SWE in
+        the gap is NaN. This keeps long gaps in the middle of a season, e.g.
+        from a sensor failure, from failing a whole station. The default is
+        False.
+
+    Raises
+    ------
+    ValueError
+        If any of the constraints on the data is violated.
+
+    Returns
+    -------
+    swe : 1D :class:`numpy.ndarray` of floats
+        Calculated SWE in `swe_output_unit`, same shape as `hs` and of type
+        `dtype`. This is `out` if given.
+    diagnostics : dict
+        Only returned if `return_diagnostics` is True. Number of timesteps
+        with each of the events in :data:`pydeltasnow.core.DIAGNOSTICS`:
+
+            - ``recompaction_error``: the re-compacted snow height deviates
+              from the observation.
+            - ``scale_excess``: layers exceed `rho_max` when scaling and their
+              excess SWE is redistributed to other layers.
+            - ``scale_runoff``: the excess SWE can not be redistributed and
+              runs off.
+            - ``saturated_scaling``: all layers exceed `rho_max` when scaling,
+              the excess SWE runs off.
+            - ``drench_runoff``: the drenched snowpack is at `rho_max`, SWE
+              runs off.
+            - ``max_layers_merge``: layers are merged due to `max_layers`.
+
+    """
+
+    for unit in [hs_input_unit, swe_output_unit]:
+        assert unit in UNIT_FACTOR.keys(), (f"swe.deltasnow: {unit} has to be "
+                                            "in {'mm', 'cm', 'm'}")
+
+    if max_layers is not None:
+        if max_layers < 1:
+            raise ValueError("DeltaSNOW: max_layers must be at least 1.")
+        if coalesce_saturated_layers:
+            raise ValueError(("DeltaSNOW: max_layers can not be combined "
+                              "with coalesce_saturated_layers."))
+
+    if engine not in ENGINES:
+        raise ValueError(("DeltaSNOW: engine must be one of "
+                          f"{', '.join(ENGINES)}"))
+
+    dtype = np.dtype(dtype)
+    if dtype.name not in FLOAT_TYPES:
+        raise ValueError(("DeltaSNOW: dtype must be one of "
+                          f"{', '.join(FLOAT_TYPES)}"))
+    if workspace is not None and workspace.dtype != dtype:
+        raise ValueError(("DeltaSNOW: workspace dtype does not match "
+                          f"dtype {dtype.name}"))
+
+    if np.iscomplexobj(hs):
+        raise ValueError("DeltaSNOW: snow depth data must be numeric")
+
+    # no copy if hs already has the right type and layout, Hobs is only
+    # modified after an explicit copy. The units are converted in the kernel.
+    Hobs = np.ascontiguousarray(hs, dtype=dtype)
+    if Hobs.ndim != 1:
+        raise ValueError("DeltaSNOW: snow depth data must be one-dimensional")
+    copied = not np.may_share_memory(Hobs, hs)
+
+    if out is None:
+        out = np.empty(len(Hobs), dtype=dtype)
+    elif (out.shape != Hobs.shape or out.dtype != dtype
+            or not out.flags.c_contiguous or not out.flags.writeable):
+        raise ValueError(("DeltaSNOW: out must be a writeable contiguous "
+                          f"array of {dtype.name} with the shape of hs"))
+
+    if np.ndim(dates_or_resolution) == 0:
+        # fixed resolution, the dates are only needed to check gaps
+        resolution = float(dates_or_resolution)
+        dates = None
+    else:
+        resolution = None
+        dates = _as_dates(dates_or_resolution, timestamp_unit)
+        if len(dates) != len(Hobs):
+            raise ValueError(("DeltaSNOW: dates and snow depth data must "
+                              "have the same length"))
+
+    ignore_gaps = ignore_zeropadded_gaps or ignore_zerofollowed_gaps
+    # ignore_zeropadded_gaps needs a zero in front and back of the gap
+    require_leading_zero = not ignore_zerofollowed_gaps
+    # without NaNs there is nothing to fill and no copy is needed
+    has_nans = interpolate_small_gaps and np.isnan(Hobs).any()
+    linear = interpolation_method == "linear"
+    fill = has_nans and linear
+
+    if fill and not copied:
+        # small gaps are filled in place
+        Hobs = Hobs.copy()
+        copied = True
+
+    if has_nans and not linear:
+        # other interpolation methods than linear are done separately. The
+        # gaps that are ignored are zeros during the interpolation like in the
+        # single pass of preprocess.
+        if dates is None:
+            dates = _regular_dates(len(Hobs), resolution)
+        if ignore_gaps:
+            zeropadded_gap_idxs = get_zeropadded_gap_idxs(
+                Hobs,
+                require_leading_zero=require_leading_zero)
+            Hobs = np.where(zeropadded_gap_idxs, 0., Hobs)
+        Hobs = fill_small_gaps(
+            Hobs,
+            dates,
+            max_gap_length,
+            interpolation_method)
+        if ignore_gaps:
+            Hobs[zeropadded_gap_idxs] = np.nan
+
+    # gap handling, validation and seasons in one pass
+    if resolution is None:
+        seasons, gaps, errors = preprocess(
+            Hobs, dates.view(np.int64), 0, ignore_gaps, require_leading_zero,
+            fill, max_gap_length, split_seasons_at_gaps)
+    else:
+        seasons, gaps, errors = preprocess(
+            Hobs, np.zeros(0, dtype=np.int64),
+            int(round(resolution * 3600e9)), ignore_gaps,
+            require_leading_zero, fill, max_gap_length,
+            split_seasons_at_gaps)
+
+    if errors & NAN_ERROR:
+        _raise_nans_error_message(
+            ignore_zeropadded_gaps,
+            ignore_zerofollowed_gaps,
+            interpolate_small_gaps,
+            max_gap_length,
+        )
+
+    if errors & NEGATIVE_ERROR:
+        raise ValueError("DeltaSNOW: snow depth data must be positive")
+
+    if errors & START_ERROR:
+        raise ValueError(("DeltaSNOW: snow depth observations must start "
+                          "with 0 or the first non nan entry \nneeds to be "
+                          "zero if you ignore zeropadded or zerofollowed gaps"))
+
+    if errors & DATES_ERROR:
+        raise ValueError(("DeltaSNOW: date column must be strictly "
+                          "regular within \nchunks of consecutive nonzeros"))
+
+    diagnostics = np.zeros(N_DIAGNOSTICS, dtype=np.int64)
+    hs_factor = UNIT_FACTOR[hs_input_unit]
+    # original R implementation (rewritten in ´.core´) returns SWE in ['mm']
+    swe_factor = 0.001 / UNIT_FACTOR[swe_output_unit]
+
+    # the number of layers in a chunk is limited by its length.
+    if workspace is None:
+        workspace = Workspace(dtype=dtype)
+    if len(seasons) > 0:
+        n_steps = np.max(seasons[:, SEASON_STOP] - seasons[:, SEASON_START])
+        n_layers = n_steps
+        if max_layers is not None:
+            n_layers = min(n_layers, max_layers + 1)
+        # seasons are copied to the series buffer for the unit conversion
+        # and if they start within a gap
+        copy_seasons = (hs_factor != 1
+                        or np.isnan(Hobs[seasons[:, SEASON_START]]).any())
+        workspace.reserve(n_layers, n_steps if copy_seasons else 0)
+
+    # the parameters have the float type of the model, otherwise float32
+    # layers would be computed in float64
+    params = np.array(
+        [rho_max, rho_null, c_ov, k_ov, k, tau, eta_null], dtype=dtype)
+    # timestep of the seasons in hours
+    resolutions = (seasons[:, SEASON_STEP] / 3600e9).astype(dtype)
+
+    swe = engine_kernel(_deltasnow_on_nonzero_chunks, engine)(
+        Hobs,
+        dtype.type(hs_factor),
+        out,
+        dtype.type(swe_factor),
+        seasons,
+        gaps,
+        *params,
+        resolutions,
+        workspace.layers,
+        workspace.counts,
+        workspace.series,
+        coalesce_saturated_layers,
+        0 if max_layers is None else max_layers,
+        diagnostics,
+    )
+
+    if return_diagnostics:
+        return swe, dict(zip(DIAGNOSTICS, diagnostics.tolist()))
+    return swe
@@ -1,11 +1,15 @@
 """
 This module contains utility functions for missing value handling and daterange
 continuity validation.
+
+:func:`preprocess` does all of this in a single pass over the data and is
+used by :func:`pydeltasnow.model.swe_deltasnow_array`. The other functions
+implement the individual steps. Series with jittered or duplicate timestamps
+can be brought onto a regular time grid with :func:`regularize` beforehand.
 """
 
-import pandas as pd
 import numpy as np
-from numba import njit
+from pydeltasnow.jit import float_signatures, njit
 
 from pydeltasnow import __version__
 
@@ -14,8 +18,75 @@ __copyright__ = "Johannes Aschauer"
 __license__ = "GPL-2.0-or-later"
 
 ONE_HOUR = np.timedelta64(1, 'h')
+ONE_HOUR_NS = 3600 * 10**9  # one hour in nanoseconds
+
+DATES_TYPE = "NPDatetime('ns')[::1]"  # numba type of the dates
+
+# columns of the season table returned by preprocess
+SEASON_START = 0  # index of the zero before the season
+SEASON_STOP = 1  # index after the season (non-inclusive)
+SEASON_STEP = 2  # timestep within the season in [ns], may differ by season
+
+# error flags of preprocess, combined bitwise
+NAN_ERROR = 1  # NaNs that are neither ignored nor interpolated
+NEGATIVE_ERROR = 2  # negative snow depth
+START_ERROR = 4  # the series does not start with zero
+DATES_ERROR = 8  # irregular dates within a season
+
+# interpolation methods of fill_small_gaps that do not need pandas, named like
+# in pandas.Series.interpolate and scipy.interpolate.interp1d
+_LINEAR, _NEAREST, _PREVIOUS, _NEXT, _PCHIP = range(5)
+INTERPOLATION_METHODS = {
+    "linear": _LINEAR,
+    "nearest": _NEAREST,
+    "zero": _PREVIOUS,
+    "previous": _PREVIOUS,
+    "next": _NEXT,
+    "pchip": _PCHIP,
+}
+
+# kinds of gaps of NaNs in preprocess
+_MISSING_GAP = 0
+_IGNORED_GAP = 1
+_FILLED_GAP = 2
+
+
+@njit(["(" + DATES_TYPE + ",)"])
+def date_steps(dates):
+    """
+    Time steps between consecutive dates.
+
+    The steps of a whole series are computed once and then used for all
+    continuity checks on parts of it.
+
+    Parameters
+    ----------
+    dates : 1D :class:`numpy.ndarray` with :class:`numpy.datetime64`  dtype
+        Input date range.
+
+    Returns
+    -------
+    steps : 1D :class:`numpy.ndarray` of int64
+        ``dates[i+1] - dates[i]`` in nanoseconds, one element shorter than
+        `dates`.
+    """
+    ns = dates.view(np.int64)
+    steps = np.empty(max(len(ns)-1, 0), dtype=np.int64)
+    for i in range(len(steps)):
+        steps[i] = ns[i+1] - ns[i]
+    return steps
+
 
 @njit
+def _continuous_steps(steps, first, last):
+    """Whether steps[first:last] all equal steps[first]."""
+    for i in range(first+1, last):
+        if steps[i] != steps[first]:
+            return False
+    return True
+
+
+@njit(["(" + DATES_TYPE + ",)"])
 def continuous_timedeltas(dr):
     """
     Check for continuity on dates
@@ -33,24 +104,40 @@ def continuous_timedeltas(dr):
 
     """
     if len(dr) <= 1:
-        continuous = True
-    else:
-        # np.gradient not working in numba
-        tdeltas = np.zeros(len(dr)-1, dtype='timedelta64[ns]')
-        for i in range(len(dr)-1):
-            tdeltas[i] = dr[i+1]-dr[i]
-
-        # check if all deltas are equal
-        continuous = np.all(tdeltas == tdeltas[0])
-        # get time resolution in hours.
-        # one hour timedelta has to be moved outside numba, see this issue for
-        # reference: https://github.com/numba/numba/issues/1750
-        resolution = tdeltas[0] / ONE_HOUR
-
-    return continuous, resolution
+        return True, 0.
+    ns = dr.view(np.int64)
+    step = ns[1] - ns[0]
+    continuous = True
+    for i in range(1, len(ns)-1):
+        if ns[i+1] - ns[i] != step:
+            continuous = False
+            break
+    return continuous, step / ONE_HOUR_NS
 
 
 @njit
+def _continuous_steps_in_chunks(steps, start_idxs, stop_idxs):
+    """
+    :func:`continuous_timedeltas_in_nonzero_chunks` on the `steps` of the
+    dates (see :func:`date_steps`).
+    """
+    continuous = True
+    first_step = 0
+    for i in range(len(start_idxs)):
+        start = start_idxs[i]
+        stop = stop_idxs[i]
+        # a chunk of a single date has resolution zero
+        step = steps[start] if stop - start > 1 else 0
+        if i == 0:
+            first_step = step
+        elif step != first_step:
+            continuous = False
+        if not _continuous_steps(steps, start, stop-1):
+            continuous = False
+    return continuous, first_step / ONE_HOUR_NS
+
+
+@njit(["(" + DATES_TYPE + ", int64[::1], int64[::1])"])
 def continuous_timedeltas_in_nonzero_chunks(
     dr,
     start_idxs,
@@ -59,6 +146,8 @@ def continuous_timedeltas_in_nonzero_chunks(
     """
     Check that every non-zero HS chunk has continuous dates and same resolution.
 
+    The time steps are computed once for the whole date range.
+
     Parameters
     ----------
     dr : 1D :class:`numpy.ndarray` with :class:`numpy.datetime64`  dtype
@@ -75,18 +164,10 @@ def continuous_timedeltas_in_nonzero_chunks(
     resolution : float
         The time resolution in hours.
     """
+    return _continuous_steps_in_chunks(date_steps(dr), start_idxs, stop_idxs)
 
-    cont = np.zeros(len(start_idxs), dtype='bool') # is chunk continuous
-    res = np.zeros(len(start_idxs)) # chunk time resolutions
-    for i, (start, stop) in enumerate(zip(start_idxs, stop_idxs)):
-        cont[i], res[i] = continuous_timedeltas(dr[start:stop])
-
-    continuous = np.all(np.array([np.all(cont), np.all(res==res[0])]))
-    resolution = res[0]
-    return continuous, resolution
 
-
-@njit
+@njit(float_signatures("({float}[::1],)"))
 def get_nonzero_chunk_idxs(Hobs):
     """
     Return start and stop indices of consecutive nonzero chunks in Hobs.
@@ -108,34 +189,45 @@ def get_nonzero_chunk_idxs(Hobs):
 
     Returns
     -------
-    start_idxs: 1D :class:`numpy.ndarray`
+    start_idxs: 1D :class:`numpy.ndarray` of int64
         Indices where a nonzero chunk begins.
-    stop_idxs: 1D :class:`numpy.ndarray`
+    stop_idxs: 1D :class:`numpy.ndarray` of int64
         Indices where a nonzero chunk ends.
     """
 
-    start_idxs = []
-    stop_idxs = []
+    n = len(Hobs)
 
-    # if first value of Hobs is not zero, set 0 as first start_idx
-    if Hobs[0] != 0:
-        start_idxs.append(0)
+    # first pass: count the chunks. A chunk starts at index 0 if Hobs does
+    # not start with zero and at every zero followed by a nonzero.
+    n_chunks = 1 if Hobs[0] != 0 else 0
+    for i in range(n-1):
+        if Hobs[i] == 0. and Hobs[i+1] != 0:
+            n_chunks += 1
 
-    for i in range(len(Hobs)):
-        if i < len(Hobs)-1:
-            if Hobs[i] == 0. and Hobs[i+1]!=0:
-                start_idxs.append(i)
-        if i > 0:
-            if Hobs[i] == 0. and Hobs[i-1]!=0:
-                stop_idxs.append(i)
+    # second pass: fill the preallocated index arrays
+    start_idxs = np.empty(n_chunks, dtype=np.int64)
+    stop_idxs = np.empty(n_chunks, dtype=np.int64)
+    n_starts = 0
+    n_stops = 0
+    if Hobs[0] != 0:
+        start_idxs[0] = 0
+        n_starts = 1
+    for i in range(n-1):
+        if Hobs[i] == 0.:
+            if Hobs[i+1] != 0:
+                start_idxs[n_starts] = i
+                n_starts += 1
+        elif Hobs[i+1] == 0.:
+            stop_idxs[n_stops] = i+1
+            n_stops += 1
 
     # if last value not zero, set last idx of Hobs as last stop_idx
-    if len(stop_idxs) < len(start_idxs):
-        stop_idxs.append(len(Hobs))
-    return np.array(start_idxs), np.array(stop_idxs)
+    if n_stops < n_starts:
+        stop_idxs[n_stops] = n
+    return start_idxs, stop_idxs
 
 
-@njit
+@njit(float_signatures("({float}[::1], boolean)"))
 def get_zeropadded_gap_idxs(
     Hobs,
     require_leading_zero,
@@ -159,9 +251,6 @@ def get_zeropadded_gap_idxs(
     """
     zeropadded_gap_idxs = np.zeros(len(Hobs), dtype='bool')
 
-    start_idxs = []
-    stop_idxs = []
-
     gap = False
     start = len(Hobs)
     for i in range(len(Hobs)):
@@ -179,32 +268,61 @@ def get_zeropadded_gap_idxs(
                     start = i
                     gap = True
 
+        # the mask is written as soon as the end of a gap is known
         if i < len(Hobs)-1:
             if np.isnan(Hobs[i]) and Hobs[i+1] == 0:
                 if gap:
-                    start_idxs.append(start)
-                    stop_idxs.append(i+1)
+                    zeropadded_gap_idxs[start:i+1] = True
 
         if not np.isnan(Hobs[i]):
             gap=False
 
-    # if last value also nan, set last idx of Hobs as last stop_idx
+    # if last value also nan, the gap extends to the end of Hobs
     if gap:
-        if len(start_idxs)>0 and start != start_idxs[-1]:
-            start_idxs.append(start)
-            stop_idxs.append(len(Hobs))
-        elif start < len(Hobs):
-            start_idxs.append(start)
-            stop_idxs.append(len(Hobs))
-
-    if len(start_idxs)>0:
-        for start_i, stop_i in zip(start_idxs, stop_idxs):
-            zeropadded_gap_idxs[start_i:stop_i] = True
+        zeropadded_gap_idxs[start:] = True
 
     return zeropadded_gap_idxs
 
 
 @njit
+def _small_gap_idxs(Hobs, steps, max_gap_length):
+    """
+    :func:`get_small_gap_idxs` on the `steps` of the dates (see
+    :func:`date_steps`).
+    """
+    small_gap_idxs = np.zeros(len(Hobs), dtype='bool')
+
+    gapl = 0  # counter of active gap length
+    active_gap = False
+    valid_gap = False
+
+    start = len(Hobs)
+    for i in range(len(Hobs)):
+        if active_gap:
+            gapl = gapl+1
+
+        if gapl > max_gap_length:
+            valid_gap = False
+
+        if i > 0:
+            if not np.isnan(Hobs[i-1]) and np.isnan(Hobs[i]):
+                start = i
+                valid_gap=True
+                active_gap = True
+
+        if np.isnan(Hobs[i-1]) and not np.isnan(Hobs[i]):
+            # the mask is written as soon as the end of a gap is known
+            if valid_gap and _continuous_steps(steps, start-1, i):
+                small_gap_idxs[start:i] = True
+
+            gapl = 0
+            active_gap = False
+            valid_gap=False
+
+    return small_gap_idxs
+
+
+@njit(float_signatures("({float}[::1], " + DATES_TYPE + ", int64)"))
 def get_small_gap_idxs(
     Hobs,
     dates,
@@ -214,7 +332,8 @@ def get_small_gap_idxs(
     Create a boolean mask for valid small gaps.
 
     Gap needs to be surrounded by values
-    Dates need to be continuous between day before gap and day after gap
+    Dates need to be continuous between day before gap and day after gap. The
+    time steps are computed once for the whole date range.
 
     Parameters
     ----------
@@ -231,45 +350,132 @@ def get_small_gap_idxs(
     small_gap_idxs : 1D :class:`numpy.ndarray` of bools
 
     """
-    small_gap_idxs = np.zeros(len(Hobs), dtype='bool')
+    return _small_gap_idxs(Hobs, date_steps(dates), max_gap_length)
 
-    start_idxs = []
-    stop_idxs = []
 
-    gapl = 0  # counter of active gap length
-    active_gap = False
-    valid_gap = False
+@njit
+def _sign(value):
+    return int(value > 0) - int(value < 0)
 
-    start = len(Hobs)
-    for i in range(len(Hobs)):
-        if active_gap:
-            gapl = gapl+1
 
-        if gapl > max_gap_length:
-            valid_gap = False
+@njit
+def _pchip_edge_slope(h0, h1, m0, m1):
+    """
+    Slope of the monotone cubic at the first or last data point, like in
+    :class:`scipy.interpolate.PchipInterpolator`.
+    """
+    d = ((2 * h0 + h1) * m0 - h0 * m1) / (h0 + h1)
+    if _sign(d) != _sign(m0):
+        return 0.
+    if _sign(m0) != _sign(m1) and abs(d) > 3. * abs(m0):
+        return 3. * m0
+    return d
 
-        if i > 0:
-            if not np.isnan(Hobs[i-1]) and np.isnan(Hobs[i]):
-                start = i
-                valid_gap=True
-                active_gap = True
 
-        if i < len(Hobs):
-            if np.isnan(Hobs[i-1]) and not np.isnan(Hobs[i]):
-                if valid_gap and continuous_timedeltas(dates[start-1:i+1])[0]:
-                    start_idxs.append(start)
-                    stop_idxs.append(i)
+@njit
+def _next_value(Hobs, k, step):
+    """Index of the next non-NaN value from k in direction step or -1."""
+    i = k + step
+    while 0 <= i < len(Hobs):
+        if not np.isnan(Hobs[i]):
+            return i
+        i = i + step
+    return -1
 
-                gapl = 0
-                active_gap = False
-                valid_gap=False
 
+@njit
+def _pchip_slope(Hobs, k):
+    """
+    Slope of the monotone cubic through the non-NaN values of Hobs at the
+    non-NaN value Hobs[k], like in :class:`scipy.interpolate.PchipInterpolator`.
+    """
+    preceding = _next_value(Hobs, k, -1)
+    following = _next_value(Hobs, k, 1)
+    if preceding < 0 and following < 0:
+        return 0.
+    if preceding >= 0 and following >= 0:
+        h0 = k - preceding
+        h1 = following - k
+        m0 = (float(Hobs[k]) - Hobs[preceding]) / h0
+        m1 = (float(Hobs[following]) - Hobs[k]) / h1
+        if _sign(m0) != _sign(m1) or m0 == 0 or m1 == 0:
+            return 0.
+        # weighted harmonic mean of the secants
+        w1 = 2 * h1 + h0
+        w2 = h1 + 2 * h0
+        return 1. / ((w1 / m0 + w2 / m1) / (w1 + w2))
+    # first or last data point
+    neighbour = following if preceding < 0 else preceding
+    step = 1 if preceding < 0 else -1
+    h0 = abs(neighbour - k)
+    m0 = (float(Hobs[neighbour]) - Hobs[k]) / (neighbour - k)
+    second = _next_value(Hobs, neighbour, step)
+    if second < 0:
+        # only two data points
+        return m0
+    h1 = abs(second - neighbour)
+    m1 = (float(Hobs[second]) - Hobs[neighbour]) / (second - neighbour)
+    return _pchip_edge_slope(h0, h1, m0, m1)
 
-    if len(start_idxs)>0:
-        for start_i, stop_i in zip(start_idxs, stop_idxs):
-            small_gap_idxs[start_i:stop_i] = True
 
-    return small_gap_idxs
+@njit
+def _fill_gap(Hobs, out, start, stop, method):
+    """
+    Interpolate the gap Hobs[start:stop] between the values at start-1 and
+    stop into out. Hobs is not modified.
+    """
+    left = start - 1
+    y0 = float(Hobs[left])
+    y1 = float(Hobs[stop])
+    d0 = c0 = c1 = 0.
+    if method == _PCHIP:
+        # cubic Hermite polynomial, evaluated like scipy.interpolate.PPoly
+        d0 = _pchip_slope(Hobs, left)
+        d1 = _pchip_slope(Hobs, stop)
+        dx = float(stop - left)
+        slope = (y1 - y0) / dx
+        t = (d0 + d1 - 2 * slope) / dx
+        c0 = t / dx
+        c1 = (slope - d0) / dx - t
+    else:
+        slope = (y1 - y0) / (stop - left)
+    for j in range(start, stop):
+        if method == _LINEAR:
+            # like numpy.interp, which is used by pandas
+            out[j] = slope * (j - left) + y0
+        elif method == _NEAREST:
+            # ties go to the left like in scipy.interpolate.interp1d
+            out[j] = y0 if j - left <= stop - j else y1
+        elif method == _PREVIOUS:
+            out[j] = y0
+        elif method == _NEXT:
+            out[j] = y1
+        else:
+            x = float(j - left)
+            out[j] = y0 + d0 * x + c1 * x * x + c0 * x * x * x
+
+
+@njit(float_signatures("({float}[::1], int64[::1], int64, int64)"))
+def _fill_small_gaps(Hobs, steps, max_gap_length, method):
+    """
+    :func:`fill_small_gaps` on the `steps` of the dates (see
+    :func:`date_steps`) with the code of `method` in
+    :data:`INTERPOLATION_METHODS`. Declares its signatures so that it is
+    part of the ahead-of-time compiled kernels.
+    """
+    out = Hobs.copy()
+    valid_gap_mask = _small_gap_idxs(Hobs, steps, max_gap_length)
+    i = 0
+    while i < len(Hobs):
+        if valid_gap_mask[i]:
+            stop = i
+            while stop < len(Hobs) and valid_gap_mask[stop]:
+                stop = stop + 1
+            _fill_gap(Hobs, out, i, stop, method)
+            i = stop
+        else:
+            i = i + 1
+    return out
 
 
 def fill_small_gaps(
@@ -285,6 +491,12 @@ def fill_small_gaps(
     Date continuity in the filled gaps + leading and trailing data point is
     ensured.
 
+    The methods in :data:`INTERPOLATION_METHODS` are computed with numba and
+    only touch the valid gaps. They give the same results as pandas, which
+    uses scipy for all of them except 'linear'. 'previous' and 'next' are
+    the kinds of :class:`scipy.interpolate.interp1d` that take the value
+    before or after the gap, 'zero' is the same as 'previous'.
+
     Parameters
     ----------
     Hobs : 1D :class:`numpy.ndarray`
@@ -294,8 +506,10 @@ def fill_small_gaps(
     max_gap_length : int
         Only gaps shorter or equal max_gap_length are interpolated.
     method : str, optional
-        Interpolation method which will be passed to 
-        :func:`pandas.Series.interpolate`. The default is 'linear'.
+        Interpolation method, named like in
+        :func:`pandas.Series.interpolate`. The default is 'linear'. Methods
+        that are not in :data:`INTERPOLATION_METHODS` are passed to pandas,
+        which is only imported in this case.
 
     Returns
     -------
@@ -303,7 +517,299 @@ def fill_small_gaps(
         Snow depth data with filled gaps.
 
     """
+    if method in INTERPOLATION_METHODS:
+        Hobs = np.asarray(Hobs)
+        if Hobs.dtype.name not in ("float64", "float32"):
+            Hobs = Hobs.astype(np.float64)
+        return _fill_small_gaps(
+            np.ascontiguousarray(Hobs),
+            date_steps(np.ascontiguousarray(dates, dtype='datetime64[ns]')),
+            max_gap_length,
+            INTERPOLATION_METHODS[method])
+
+    import pandas as pd
+
     valid_gap_mask = get_small_gap_idxs(Hobs, dates, max_gap_length)
     interpolated = pd.Series(Hobs).interpolate(method=method).to_numpy()
     Hobs_interpolated = np.where(valid_gap_mask, interpolated, Hobs)
     return Hobs_interpolated
+
+
+@njit
+def _grow(table, n_rows):
+    """Return `table` or an enlarged copy of it if row `n_rows` does not fit."""
+    if n_rows < len(table):
+        return table
+    grown = np.empty((2 * len(table), table.shape[1]), dtype=table.dtype)
+    grown[:n_rows] = table[:n_rows]
+    return grown
+
+
+@njit
+def _regular_steps(dates, first, last):
+    """Whether the timesteps between dates[first] and dates[last] are equal."""
+    step = dates[first + 1] - dates[first]
+    for i in range(first + 1, last):
+        if dates[i + 1] - dates[i] != step:
+            return False
+    return True
+
+
+@njit(float_signatures(
+    "({float}[::1], int64[::1], int64, boolean, boolean, boolean, int64, "
+    "boolean)"))
+def preprocess(
+    Hobs,
+    dates,
+    step,
+    ignore_gaps,
+    require_leading_zero,
+    fill_small_gaps,
+    max_gap_length,
+    split_seasons=False,
+):
+    """
+    Classify gaps, interpolate small gaps, validate the data and find the
+    seasons (chunks of nonzeros) in one pass over `Hobs`.
+
+    Gaps of NaNs are classified like in :func:`get_zeropadded_gap_idxs` and
+    :func:`get_small_gap_idxs`: a gap is ignored if `ignore_gaps` is True, it
+    is followed by a zero (or the end of the series) and preceded by a zero
+    (or the start of the series) in case `require_leading_zero` is True.
+    Ignored gaps count as zeros, `Hobs` is not modified there. Otherwise, a
+    gap is linearly interpolated in place if `fill_small_gaps` is True, it is
+    surrounded by data, not longer than `max_gap_length` and the dates from
+    the data point before to the data point after the gap are regular. All
+    other gaps are missing data, unless `split_seasons` is True: then they
+    are ignored as well and split the season they are in. The season before
+    the gap ends at the gap and a new season starts at the last NaN of the
+    gap, which has to be modeled as zero.
+
+    Parameters
+    ----------
+    Hobs : 1D :class:`numpy.ndarray` of floats
+        input HS data, small gaps are filled in place.
+    dates : 1D :class:`numpy.ndarray` of int64
+        Timestamps of the snow depth observations in [ns]. Pass an empty
+        array if `Hobs` is regular with the timestep `step`.
+    step : int
+        Timestep in [ns] for regular `Hobs` without `dates`.
+    ignore_gaps : bool
+        Whether to ignore gaps followed by zeros.
+    require_leading_zero : bool
+        Whether ignored gaps additionally need to be preceded by a zero.
+    fill_small_gaps : bool
+        Whether to linearly interpolate small gaps.
+    max_gap_length : int
+        Only gaps shorter or equal max_gap_length are interpolated.
+    split_seasons : bool, optional
+        Whether to split seasons at gaps that are neither ignored nor
+        interpolated instead of flagging them as :data:`NAN_ERROR`. The
+        default is False.
+
+    Returns
+    -------
+    seasons : 2D :class:`numpy.ndarray` of int64
+        Season table with one row per chunk of nonzeros, the columns are
+        :data:`SEASON_START`, :data:`SEASON_STOP` and :data:`SEASON_STEP`.
+        Like in :func:`get_nonzero_chunk_idxs`, a season includes the
+        leading zero. The dates need to be regular within a season, but
+        different seasons can have different timesteps (e.g. daily manual
+        readings followed by hourly sensor data).
+    gaps : 2D :class:`numpy.ndarray` of int64
+        Start and stop index of the ignored gaps, one row per gap.
+    errors : int
+        Combination of the error flags :data:`NAN_ERROR`,
+        :data:`NEGATIVE_ERROR`, :data:`START_ERROR` and :data:`DATES_ERROR`
+        or zero if the data is valid.
+    """
+    n = len(Hobs)
+    check_dates = len(dates) > 0
+
+    seasons = np.empty((16, 3), dtype=np.int64)
+    n_seasons = 0
+    gaps = np.empty((16, 2), dtype=np.int64)
+    n_gaps = 0
+    errors = 0
+
+    gap_stop = 0  # stop index of the last gap
+    gap_kind = _MISSING_GAP
+    prev = 0.  # value of the previous timestep, ignored gaps count as zero
+    in_season = False
+    season_start = 0
+    season_step = -1  # -1 until the season has two timesteps
+
+    for i in range(n):
+        if i >= gap_stop and np.isnan(Hobs[i]):
+            # classify the new gap
+            gap_stop = i + 1
+            while gap_stop < n and np.isnan(Hobs[gap_stop]):
+                gap_stop = gap_stop + 1
+            leading = i == 0 or not require_leading_zero or Hobs[i - 1] == 0
+            trailing = gap_stop == n or Hobs[gap_stop] == 0
+            fillable = (fill_small_gaps and i > 0 and gap_stop < n
+                        and gap_stop - i <= max_gap_length
+                        and (not check_dates
+                             or _regular_steps(dates, i - 1, gap_stop)))
+            if ((ignore_gaps and leading and trailing)
+                    or (split_seasons and not fillable)):
+                # counts as zero, a gap within a season ends the season
+                # before and restarts the snowpack after the gap
+                gap_kind = _IGNORED_GAP
+                gaps = _grow(gaps, n_gaps)
+                gaps[n_gaps, 0] = i
+                gaps[n_gaps, 1] = gap_stop
+                n_gaps = n_gaps + 1
+            elif fillable:
+                gap_kind = _FILLED_GAP
+                _fill_gap(Hobs, Hobs, i, gap_stop, _LINEAR)
+            else:
+                gap_kind = _MISSING_GAP
+
+        if i < gap_stop and gap_kind == _IGNORED_GAP:
+            value = 0.
+        else:
+            value = Hobs[i]
+            if np.isnan(value):
+                errors = errors | NAN_ERROR
+            elif value < 0:
+                errors = errors | NEGATIVE_ERROR
+
+        # seasons, NaNs count as nonzeros
+        if i == 0:
+            if value != 0:
+                errors = errors | START_ERROR
+                in_season = True
+                season_start = 0
+                season_step = -1
+        elif prev == 0 and value != 0:
+            in_season = True
+            season_start = i - 1
+            season_step = -1
+        elif prev != 0 and value == 0:
+            in_season = False
+            seasons = _grow(seasons, n_seasons)
+            seasons[n_seasons, SEASON_START] = season_start
+            seasons[n_seasons, SEASON_STOP] = i
+            seasons[n_seasons, SEASON_STEP] = season_step
+            n_seasons = n_seasons + 1
+
+        # regular dates within seasons
+        if in_season and i > season_start:
+            if not check_dates:
+                season_step = step
+            elif season_step < 0:
+                season_step = dates[i] - dates[i - 1]
+            elif dates[i] - dates[i - 1] != season_step:
+                errors = errors | DATES_ERROR
+
+        prev = value
+
+    if in_season:
+        seasons = _grow(seasons, n_seasons)
+        seasons[n_seasons, SEASON_START] = season_start
+        seasons[n_seasons, SEASON_STOP] = n
+        seasons[n_seasons, SEASON_STEP] = season_step
+        n_seasons = n_seasons + 1
+
+    return seasons[:n_seasons].copy(), gaps[:n_gaps].copy(), errors
+
+
+@njit(float_signatures("({float}[::1], int64[::1], int64)"))
+def _regularize(Hobs, dates, step):
+    """
+    :func:`regularize` on int64 `dates` and `step` in [ns]. Returns the
+    regular snow depths and their dates in [ns]. `dates` must not contain
+    NaT, which is the smallest int64 and would span the grid back to 1677.
+    """
+    n = len(Hobs)
+    if n == 0:
+        return np.zeros(0, Hobs.dtype), np.zeros(0, np.int64)
+
+    # snap to the nearest multiple of step, ties are rounded up
+    first = (dates[0] + step // 2) // step
+    last = first
+    for i in range(1, n):
+        slot = (dates[i] + step // 2) // step
+        first = min(first, slot)
+        last = max(last, slot)
+
+    # mean of the non-NaN values in every slot
+    n_slots = last - first + 1
+    sums = np.zeros(n_slots)
+    counts = np.zeros(n_slots, dtype=np.int64)
+    for i in range(n):
+        if not np.isnan(Hobs[i]):
+            slot = (dates[i] + step // 2) // step - first
+            sums[slot] = sums[slot] + Hobs[i]
+            counts[slot] = counts[slot] + 1
+
+    Hobs_regular = np.empty(n_slots, Hobs.dtype)
+    dates_regular = np.empty(n_slots, np.int64)
+    for slot in range(n_slots):
+        if counts[slot] > 0:
+            Hobs_regular[slot] = sums[slot] / counts[slot]
+        else:
+            Hobs_regular[slot] = np.nan
+        dates_regular[slot] = (first + slot) * step
+    return Hobs_regular, dates_regular
+
+
+def regularize(
+    Hobs,
+    dates,
+    resolution,
+):
+    """
+    Put snow depth observations with irregular timestamps on a regular time
+    grid.
+
+    Every timestamp is snapped to the nearest multiple of `resolution` (since
+    the epoch), so that jittered timestamps land on the grid. Observations
+    that end up on the same grid point are averaged, NaNs are skipped. Grid
+    points without any observation are NaN, they are treated as gaps by the
+    model, e.g. with `interpolate_small_gaps`. Unlike
+    :meth:`pandas.Series.resample`, the timestamps do not need to be sorted
+    and no pandas objects are created.
+
+    Parameters
+    ----------
+    Hobs : 1D :class:`numpy.ndarray` of floats
+        Snow depth data.
+    dates : 1D :class:`numpy.ndarray` of :class:`numpy.datetime64`  dtype
+        timestamps of the snow depth observations.
+    resolution : float
+        Time resolution of the grid in hours.
+
+    Raises
+    ------
+    ValueError
+        If `Hobs` and `dates` differ in length, `dates` contains NaT or
+        `resolution` is not positive.
+
+    Returns
+    -------
+    Hobs_regular : 1D :class:`numpy.ndarray`
+        Snow depth data on the grid, with the dtype of `Hobs` for float32 and
+        float64 data and float64 otherwise.
+    dates_regular : 1D :class:`numpy.ndarray` of :class:`numpy.datetime64`
+        Regular dates from the first to the last grid point.
+    """
+    Hobs = np.asarray(Hobs)
+    if Hobs.dtype.name not in ("float64", "float32"):
+        Hobs = Hobs.astype(np.float64)
+    dates = np.asarray(dates, dtype="datetime64[ns]")
+    if len(dates) != len(Hobs):
+        raise ValueError(("DeltaSNOW: dates and snow depth data must "
+                          "have the same length"))
+    if np.isnat(dates).any():
+        raise ValueError("DeltaSNOW: dates must not contain NaT")
+    step = int(round(resolution * 3600e9))
+    if step <= 0:
+        raise ValueError("DeltaSNOW: resolution must be positive")
+
+    Hobs_regular, dates_regular = _regularize(
+        np.ascontiguousarray(Hobs),
+        np.ascontiguousarray(dates).view(np.int64),
+        step)
+    return Hobs_regular, dates_regular.view("datetime64[ns]")
@@ -1,10 +1,154 @@
 """
-    Dummy conftest.py for pydeltasnow.
+Fixtures shared by the test modules.
 
-    If you don't know what this is for, just leave it empty.
-    Read more about conftest.py under:
-    - https://docs.pytest.org/en/stable/fixture.html
-    - https://docs.pytest.org/en/stable/writing_plugins.html
+The `tests/data` directory holds input HS data and SWE data calculated with the
+nixmass R package respectively as well as scripts to get this data.
 """
+from distutils import dir_util
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import sys
 
-# import pytest
+import pytest
+import numpy as np
+import pandas as pd
+
+__author__ = "Johannes Aschauer"
+__copyright__ = "Johannes Aschauer"
+__license__ = "GPL-2.0-or-later"
+
+
+@pytest.fixture
+def datadir(tmpdir, request):
+    '''
+    Fixture responsible for searching a folder with the same name of test
+    module and, if available, moving all contents to a temporary directory so
+    tests can use them freely.
+
+    Adapted from: https://stackoverflow.com/a/29631801
+    '''
+    filename =  Path(request.module.__file__)
+    test_dir = filename.parent / "data"
+
+    if os.path.isdir(test_dir):
+        dir_util.copy_tree(test_dir, str(tmpdir))
+
+    return tmpdir
+
+
+@pytest.fixture
+def hs_5wj_as_series(datadir):
+    # HS in [m]
+    df = (pd.read_csv(datadir.join("hs_data_5WJ.csv"))
+          .loc[:, ["date", "hs"]]
+          .assign(date=lambda x: pd.to_datetime(x['date']))
+          .set_index('date')
+          .squeeze()
+          )
+    return df
+
+
+@pytest.fixture
+def hs_5df_as_series(datadir):
+    # HS in [m]
+    df = (pd.read_csv(datadir.join("hs_data_5DF.csv"))
+          .loc[:, ["date", "hs"]]
+          .assign(date=lambda x: pd.to_datetime(x['date']))
+          .set_index('date')
+          .squeeze()
+          )
+    return df
+
+
+@pytest.fixture
+def hs_1ad_as_series(datadir):
+    # HS in [m]
+    df = (pd.read_csv(datadir.join("hs_data_1AD.csv"))
+          .loc[:, ["date", "hs"]]
+          .assign(date=lambda x: pd.to_datetime(x['date']))
+          .set_index('date')
+          .squeeze()
+          )
+    return df
+
+
+@pytest.fixture
+def swe_5wj_as_series(datadir):
+    # SWE in [mm]
+    return pd.read_csv(datadir.join("swe_data_5WJ.csv"),
+                       parse_dates=['date'],
+                       index_col='date').squeeze()
+
+
+@pytest.fixture
+def swe_5df_as_series(datadir):
+    # SWE in [mm]
+    return pd.read_csv(datadir.join("swe_data_5DF.csv"),
+                       parse_dates=['date'],
+                       index_col='date').squeeze()
+
+
+@pytest.fixture
+def swe_1ad_as_series(datadir):
+    # SWE in [mm]
+    return pd.read_csv(datadir.join("swe_data_1AD.csv"),
+                       parse_dates=['date'],
+                       index_col='date').squeeze()
+
+
+@pytest.fixture
+def model_params():
+    """
+    Model parameters as keywords of the numba kernels in
+    :mod:`pydeltasnow.core`, in the order of their positional arguments.
+    """
+    return dict(
+        rho_max=401.2588,
+        rho_null=81.19417,
+        c_ov=0.0005104722,
+        k_ov=0.37856737,
+        k=0.02993175,
+        tau=0.02362476,
+        eta_null=8523356.,
+        resolution=24.,
+        )
+
+
+@pytest.fixture
+def perennial_hs():
+    """
+    Synthetic daily series of ten years of perennial snow in [m]: the
+    snowpack never melts out and old layers reach rho_max.
+    """
+    rng = np.random.default_rng(1)
+    n_steps = 365 * 10
+    Hobs = np.zeros(n_steps + 2)
+    hs = 0.
+    for t in range(1, n_steps + 1):
+        if t % 365 < 200:
+            hs = hs + 0.05 if rng.random() < 0.3 else hs * 0.995
+        else:
+            hs = hs - 0.04 if rng.random() < 0.3 else hs * 0.995
+        Hobs[t] = max(hs, 0.5 if t > 10 else 0.05)
+    return Hobs
+
+
+@pytest.fixture(scope="session")
+def aot_package(tmp_path_factory):
+    """
+    Copy of the package with the ahead-of-time compiled kernels. Building
+    the extension module takes about a minute and needs a C compiler, tests
+    that use it are marked with ``aot``.
+    """
+    pytest.importorskip("numba.pycc")
+    if shutil.which("cc") is None and shutil.which("gcc") is None:
+        pytest.skip("no C compiler available")
+    path = tmp_path_factory.mktemp("aot")
+    source = Path(__file__).parents[1] / "src" / "pydeltasnow"
+    shutil.copytree(source, path / "pydeltasnow",
+                    ignore=shutil.ignore_patterns("__pycache__", "*.so"))
+    subprocess.run([sys.executable, "-m", "pydeltasnow.aot"], cwd=path,
+                   env=dict(os.environ, PYTHONPATH=str(path)), check=True)
+    return path
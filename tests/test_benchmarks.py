@@ -0,0 +1,295 @@
+"""
+Runtime benchmarks of the numba kernels on synthetic and measured snow depth
+series.
+
+The benchmarks only assert on runtime ratios (and not on absolute runtimes)
+in order to be robust against the speed of the machine they run on. They are
+deselected by default; run them explicitly with ``pytest -m benchmark``. The
+ahead-of-time compilation benchmark additionally carries the ``aot`` marker,
+skip it with ``pytest -m "benchmark and not aot"``.
+"""
+import os
+from pathlib import Path
+import subprocess
+import sys
+import time
+
+import pytest
+import numpy as np
+
+from pydeltasnow.core import (
+    N_DIAGNOSTICS,
+    N_LAYER_BUFFERS,
+    _snowpack_evolution,
+    deltasnow_layer_evolution,
+    deltasnow_snowpack_evolution,
+    )
+from pydeltasnow.model import swe_deltasnow_array
+from pydeltasnow.utils import get_nonzero_chunk_idxs
+
+__author__ = "Johannes Aschauer"
+__copyright__ = "Johannes Aschauer"
+__license__ = "GPL-2.0-or-later"
+
+pytestmark = pytest.mark.benchmark
+
+
+@pytest.fixture
+def hourly_params(model_params):
+    """Positional model parameters of the kernels at hourly resolution."""
+    return tuple(dict(model_params, resolution=1.).values())
+
+
+def _best_of(func, *args, repeat=3):
+    """Minimum wall time of `repeat` calls of `func` in seconds."""
+    func(*args)  # make sure everything is compiled
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def _snowfall_season(n_steps):
+    """
+    Season with a new snow layer in every timestep: the number of layers grows
+    linearly with the season length.
+    """
+    Hobs = np.zeros(n_steps + 2)
+    Hobs[1:-1] = 0.05 * np.arange(1, n_steps + 1)
+    return Hobs
+
+
+def test_season_runtime_scales_with_timesteps_times_layers(hourly_params):
+    # With a layer added in every timestep, the work per season is
+    # proportional to T * layers ~ T**2. Doubling T must therefore roughly
+    # quadruple the runtime. A cubic overburden computation would lead to a
+    # factor of eight.
+    t_short = _best_of(
+        deltasnow_snowpack_evolution, _snowfall_season(1000), *hourly_params)
+    t_long = _best_of(
+        deltasnow_snowpack_evolution, _snowfall_season(2000), *hourly_params)
+    assert t_long / t_short < 6
+
+
+def _single_layer_season(n_steps):
+    """
+    Season with only one snowfall at the beginning: a single layer exists
+    during the whole season.
+    """
+    Hobs = np.zeros(n_steps + 2)
+    Hobs[1:-1] = 1.
+    return Hobs
+
+
+def test_step_cost_follows_layer_occupancy(hourly_params):
+    # The number of preallocated layers equals the number of nonzero
+    # timesteps. With a single occupied layer, the cost per step must not
+    # depend on it.
+    t_short = _best_of(
+        deltasnow_snowpack_evolution, _single_layer_season(10000), *hourly_params)
+    t_long = _best_of(
+        deltasnow_snowpack_evolution, _single_layer_season(40000), *hourly_params)
+    assert (t_long / 40000) / (t_short / 10000) < 2
+
+    # A fully occupied snowpack is expensive per step in comparison.
+    t_sparse = _best_of(
+        deltasnow_snowpack_evolution, _single_layer_season(2000), *hourly_params)
+    t_dense = _best_of(
+        deltasnow_snowpack_evolution, _snowfall_season(2000), *hourly_params)
+    assert t_dense / t_sparse > 10
+
+
+def _hourly_season(n_steps, seed=0):
+    """
+    Synthetic hourly season with occasional snowfalls during accumulation,
+    settling and occasional melt events during ablation.
+    """
+    rng = np.random.default_rng(seed)
+    Hobs = np.zeros(n_steps + 2)
+    hs = 0.
+    n_accumulation = int(0.6 * n_steps)
+    for t in range(1, n_steps + 1):
+        if t <= n_accumulation:
+            hs = hs + 0.03 if rng.random() < 0.1 else hs * 0.9995
+        else:
+            hs = hs - 0.03 if rng.random() < 0.1 else hs * 0.9995
+        Hobs[t] = max(hs, 0.01)
+    return Hobs
+
+
+def _layer_history_args(Hobs, params, resolution, time_major):
+    """
+    Arguments of the kernel with layer history in time-major (days X layers,
+    C-order) or layer-major (layers X days, accessed through a transposed
+    view) storage. The buffers are allocated up front so that only the
+    kernel is timed.
+    """
+    n_steps = len(Hobs)
+    ly_tot = np.count_nonzero(Hobs)
+    layers = np.empty((N_LAYER_BUFFERS, ly_tot))
+    counts = np.empty(ly_tot, dtype=np.int64)
+    if time_major:
+        history = [np.zeros((n_steps, ly_tot)) for _ in range(3)]
+    else:
+        history = [np.zeros((ly_tot, n_steps)).T for _ in range(3)]
+    return (
+        Hobs, *params[:-1], resolution, np.zeros(n_steps), layers, counts,
+        np.zeros(n_steps), *history, True, False, 0,
+        np.zeros(N_DIAGNOSTICS, dtype=np.int64))
+
+
+def _layer_history(args):
+    return _snowpack_evolution(*args)
+
+
+def _on_seasons(func, seasons, *args):
+    for Hobs in seasons:
+        func(Hobs, *args)
+
+
+@pytest.mark.parametrize(
+    "station, max_ratio",
+    [
+        # short daily seasons, the history of a season fits into the cache
+        ("5wj", 1.),
+        # long seasons, every history write of the layer-major layout
+        # touches a separate cache line
+        ("hourly", 0.85),
+        ("snowfall", 0.75),
+    ],
+)
+def test_layer_layout(station, max_ratio, hourly_params, request):
+    if station == "5wj":
+        Hobs = request.getfixturevalue("hs_5wj_as_series").to_numpy()
+        start_idxs, stop_idxs = get_nonzero_chunk_idxs(Hobs)
+        seasons = [Hobs[start:stop] for start, stop in zip(start_idxs, stop_idxs)]
+        resolution = 24.
+    elif station == "hourly":
+        seasons = [_hourly_season(6000)]
+        resolution = 1.
+    else:
+        seasons = [_snowfall_season(3000)]
+        resolution = 1.
+
+    t_rolling = _best_of(
+        _on_seasons,
+        lambda Hobs, res: deltasnow_snowpack_evolution(
+            Hobs, *hourly_params[:-1], res),
+        seasons,
+        resolution)
+    time_major = [_layer_history_args(Hobs, hourly_params, resolution, True)
+                  for Hobs in seasons]
+    layer_major = [_layer_history_args(Hobs, hourly_params, resolution, False)
+                   for Hobs in seasons]
+    t_time_major = _best_of(_on_seasons, _layer_history, time_major, repeat=5)
+    t_layer_major = _best_of(_on_seasons, _layer_history, layer_major, repeat=5)
+
+    # The contiguous rolling layer vectors are the fastest option. Writing
+    # the history contiguously is faster than the strided layout as soon as
+    # the history does not fit into the cache anymore.
+    assert t_rolling < t_layer_major
+    assert t_time_major < max_ratio * t_layer_major
+
+
+def test_coalescing_saturated_layers(perennial_hs, model_params):
+    params = tuple(model_params.values())
+    t_exact = _best_of(
+        deltasnow_snowpack_evolution, perennial_hs, *params, False)
+    t_coalesced = _best_of(
+        deltasnow_snowpack_evolution, perennial_hs, *params, True)
+    assert t_coalesced < 0.5 * t_exact
+
+
+def _saturating_season(n_steps):
+    """
+    Hourly season with a new layer every fifth step and scaling in between,
+    the lower layers frequently exceed rho_max during scaling.
+    """
+    Hobs = np.zeros(n_steps + 2)
+    hs = 0.
+    for t in range(1, n_steps + 1):
+        hs = hs + 0.03 if t % 5 == 1 else hs * 0.999
+        Hobs[t] = hs
+    return Hobs
+
+
+def test_excess_redistribution_is_linear_in_layers(hourly_params):
+    # timesteps and layers double, the work per step must only double as well
+    t_short = _best_of(
+        deltasnow_snowpack_evolution, _saturating_season(2000), *hourly_params)
+    t_long = _best_of(
+        deltasnow_snowpack_evolution, _saturating_season(4000), *hourly_params)
+    assert t_long / t_short < 6
+
+
+def test_float32_layer_history(hourly_params):
+    # The layer history is limited by memory bandwidth, float32 halves the
+    # memory traffic.
+    Hobs = _snowfall_season(3000)
+    params32 = [np.float32(p) for p in hourly_params]
+    t_float64 = _best_of(deltasnow_layer_evolution, Hobs, *hourly_params)
+    t_float32 = _best_of(
+        deltasnow_layer_evolution, Hobs.astype(np.float32), *params32)
+    assert t_float32 < 0.9 * t_float64
+
+
+def test_float32_pipeline(hs_5wj_as_series):
+    # The per-layer loops of the full model are latency bound and compute in
+    # float64 anyway, float32 saves memory but must not slow the model down.
+    hs = np.tile(hs_5wj_as_series.fillna(0).to_numpy(), 20)
+    t_float64 = _best_of(swe_deltasnow_array, hs, 24)
+    t_float32 = _best_of(
+        lambda hs: swe_deltasnow_array(hs, 24, dtype=np.float32),
+        hs.astype(np.float32))
+    assert t_float32 < 1.15 * t_float64
+
+
+COLD_START = """
+import sys
+import time
+start = time.perf_counter()
+import numpy as np
+import pandas as pd
+from pydeltasnow import jit, swe_deltasnow
+hs = pd.read_csv(sys.argv[1]).loc[:, ["date", "hs"]]
+hs = pd.Series(hs["hs"].to_numpy(), index=pd.to_datetime(hs["date"]))
+swe = swe_deltasnow(hs, ignore_zeropadded_gaps=True, interpolate_small_gaps=True)
+swe32 = swe_deltasnow(hs, ignore_zeropadded_gaps=True, interpolate_small_gaps=True,
+                      dtype="float32")
+print(jit.BACKEND, "numba" in sys.modules, time.perf_counter() - start, swe.sum(),
+      swe32.sum())
+"""
+
+
+def _cold_start(package, disable_aot):
+    env = dict(os.environ, PYTHONPATH=str(package))
+    if disable_aot:
+        env["PYDELTASNOW_DISABLE_AOT"] = "1"
+    hs_file = Path(__file__).parent / "data" / "hs_data_5WJ.csv"
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, "-c", COLD_START, str(hs_file)],
+        env=env, capture_output=True, check=True, text=True,
+    ).stdout
+    elapsed = time.perf_counter() - start
+    backend, numba_imported, _, swe_sum, swe32_sum = out.split()
+    return (elapsed, backend, numba_imported == "True",
+            (float(swe_sum), float(swe32_sum)))
+
+
+@pytest.mark.aot
+def test_cold_start_aot_vs_jit(aot_package):
+    _cold_start(aot_package, disable_aot=True)  # populate the jit cache
+    t_jit, backend, numba_imported, swe_jit = min(
+        _cold_start(aot_package, disable_aot=True) for _ in range(3))
+    assert backend == "jit" and numba_imported
+    t_aot, backend, numba_imported, swe_aot = min(
+        _cold_start(aot_package, disable_aot=False) for _ in range(3))
+    assert backend == "aot" and not numba_imported
+
+    assert swe_aot == swe_jit
+    # even with a warm cache, the jit startup needs to import numba and load
+    # the kernels
+    assert t_aot < t_jit
@@ -0,0 +1,125 @@
+"""
+Tests for the numba kernels in :mod:`pydeltasnow.core`.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+import numpy as np
+
+from pydeltasnow.core import (
+    deltasnow_layer_evolution,
+    deltasnow_snowpack_evolution,
+    )
+from pydeltasnow.utils import get_nonzero_chunk_idxs
+
+__author__ = "Johannes Aschauer"
+__copyright__ = "Johannes Aschauer"
+__license__ = "GPL-2.0-or-later"
+
+ALLOCATION_SCRIPT = """
+import json
+import numpy as np
+from numba.core.runtime import rtsys
+from pydeltasnow.core import deltasnow_snowpack_evolution
+
+def season(n_steps, snowfall):
+    Hobs = np.zeros(n_steps + 2)
+    hs = 0.
+    for t in range(1, n_steps + 1):
+        # a new layer every step or a single layer that only gets scaled
+        hs = hs + 0.03 if snowfall or t == 1 else hs * 0.999
+        Hobs[t] = hs
+    return Hobs
+
+def run(Hobs):
+    deltasnow_snowpack_evolution(Hobs, 401.2588, 81.19417, 0.0005104722,
+                                 0.37856737, 0.02993175, 0.02362476,
+                                 8523356., 1.)
+
+def allocations(Hobs):
+    before = rtsys.get_allocation_stats().alloc
+    run(Hobs)
+    return rtsys.get_allocation_stats().alloc - before
+
+run(season(10, True))  # compile and initialize the runtime
+print(json.dumps({
+    f"{snowfall} {n_steps}": allocations(season(n_steps, snowfall))
+    for snowfall in [True, False] for n_steps in [200, 800]}))
+"""
+
+
+def _seasons(hs):
+    Hobs = hs.to_numpy()
+    start_idxs, stop_idxs = get_nonzero_chunk_idxs(Hobs)
+    return [Hobs[start:stop] for start, stop in zip(start_idxs, stop_idxs)]
+
+
+@pytest.mark.parametrize(
+    "input_hs_data",
+    ["hs_5wj_as_series", "hs_5df_as_series", "hs_1ad_as_series"],
+)
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_rolling_and_dense_kernel_are_identical(
+        input_hs_data, dtype, model_params, request):
+    hs = request.getfixturevalue(input_hs_data)
+    params = {name: dtype(value) for name, value in model_params.items()}
+    for Hobs in _seasons(hs):
+        Hobs = Hobs.astype(dtype)
+        swe_rolling = deltasnow_snowpack_evolution(Hobs, **params)
+        swe_dense, H, h, swe, age = deltasnow_layer_evolution(Hobs, **params)
+        np.testing.assert_array_equal(swe_rolling, swe_dense)
+
+        ly_tot = np.count_nonzero(Hobs)
+        assert h.shape == swe.shape == age.shape == (len(Hobs), ly_tot)
+        assert swe_rolling.dtype == h.dtype == swe.dtype == age.dtype == dtype
+        rtol = 1e-7 if dtype == np.float64 else 1e-4
+        np.testing.assert_allclose(swe.sum(axis=1), swe_dense, rtol=rtol)
+        np.testing.assert_allclose(h.sum(axis=1), H, rtol=rtol)
+
+
+@pytest.mark.parametrize(
+    "input_hs_data",
+    ["hs_5wj_as_series", "hs_5df_as_series", "hs_1ad_as_series"],
+)
+def test_modeled_snow_height_follows_observations(
+        input_hs_data, model_params, request):
+    # New layers, scaling and drenching all adapt the snowpack to the observed
+    # snow height.
+    hs = request.getfixturevalue(input_hs_data)
+    for Hobs in _seasons(hs):
+        _, H, h, _, _ = deltasnow_layer_evolution(Hobs, **model_params)
+        np.testing.assert_allclose(H, Hobs, rtol=0, atol=1e-6)
+        np.testing.assert_allclose(h.sum(axis=1), Hobs, rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize(
+    "input_hs_data",
+    ["hs_5wj_as_series", "hs_5df_as_series", "hs_1ad_as_series", "perennial_hs"],
+)
+def test_coalescing_saturated_layers_does_not_change_swe(
+        input_hs_data, model_params, request):
+    if input_hs_data == "perennial_hs":
+        seasons = [request.getfixturevalue(input_hs_data)]
+    else:
+        seasons = _seasons(request.getfixturevalue(input_hs_data))
+    for Hobs in seasons:
+        swe_exact = deltasnow_snowpack_evolution(Hobs, **model_params)
+        swe_coalesced = deltasnow_snowpack_evolution(
+            Hobs, **model_params, coalesce_saturated=True)
+        np.testing.assert_allclose(swe_coalesced, swe_exact, rtol=1e-9, atol=1e-9)
+
+
+def test_allocations_do_not_grow_with_season_length():
+    # All per-step buffers live in the workspace, the number of NRT
+    # allocations of a kernel call must not depend on the season length.
+    env = dict(os.environ, NUMBA_NRT_STATS="1")
+    out = subprocess.run(
+        [sys.executable, "-c", ALLOCATION_SCRIPT],
+        env=env, capture_output=True, check=True, text=True).stdout
+    allocations = json.loads(out.splitlines()[-1])
+    assert allocations["True 200"] == allocations["True 800"]
+    assert allocations["False 200"] == allocations["False 800"]
+    assert allocations["True 800"] == allocations["False 800"]
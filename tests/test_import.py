@@ -0,0 +1,62 @@
+"""
+Regression tests for the import time of pydeltasnow.
+
+The imports are measured in fresh python processes.
+"""
+import json
+import subprocess
+import sys
+
+import pytest
+
+__author__ = "Johannes Aschauer"
+__copyright__ = "Johannes Aschauer"
+__license__ = "GPL-2.0-or-later"
+
+
+SCRIPT = """
+import json
+import sys
+import time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"time": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def _import_in_new_process(module):
+    out = subprocess.run(
+        [sys.executable, "-c", SCRIPT.format(module=module)],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def test_import_is_lazy():
+    lazy = _import_in_new_process("pydeltasnow")
+    for heavy in ["numba", "pandas", "numpy", "pydeltasnow.core",
+                  "pydeltasnow.main", "pydeltasnow.utils"]:
+        assert heavy not in lazy["modules"]
+
+    full = _import_in_new_process("pydeltasnow.main")
+    assert "pandas" in full["modules"]
+    assert lazy["time"] < 0.25 * full["time"]
+
+
+def test_model_does_not_import_pandas():
+    model = _import_in_new_process("pydeltasnow.model")
+    assert "pandas" not in model["modules"]
+
+
+def test_lazy_attributes():
+    import pydeltasnow
+    from pydeltasnow import main
+
+    assert pydeltasnow.swe_deltasnow is main.swe_deltasnow
+    assert pydeltasnow.core.Workspace is pydeltasnow.Workspace
+    assert "swe_deltasnow" in dir(pydeltasnow)
+    with pytest.raises(AttributeError):
+        pydeltasnow.does_not_exist
@@ -0,0 +1,180 @@
+"""
+Tests for the compilation of the numba kernels.
+
+The cache tests compile the kernels in fresh python processes with an empty
+cache directory, so they take a few seconds.
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+import numpy as np
+
+import pydeltasnow
+from pydeltasnow import jit, swe_deltasnow
+from pydeltasnow.core import deltasnow_snowpack_evolution
+
+__author__ = "Johannes Aschauer"
+__copyright__ = "Johannes Aschauer"
+__license__ = "GPL-2.0-or-later"
+
+
+SCRIPT = """
+import json
+import numpy as np
+import pandas as pd
+import pydeltasnow
+
+hs = pd.Series(
+    data=np.array([0., 0.1, 0.25, 0.2, 0.22, 0.1, 0., 0.]),
+    index=pd.date_range("2000-01-01", periods=8),
+)
+pydeltasnow.swe_deltasnow(hs)
+pydeltasnow.swe_deltasnow(hs, engine="fast")
+print(json.dumps(pydeltasnow.cache_info()))
+"""
+
+KERNEL = "pydeltasnow.model._deltasnow_on_nonzero_chunks"
+
+GAP_SCRIPT = """
+import json
+import sys
+import numpy as np
+from pydeltasnow import jit
+from pydeltasnow.model import swe_deltasnow_array
+
+hs = np.array([0., 0.1, 0.25, np.nan, np.nan, 0.22, 0.1, np.nan, 0.05, 0.])
+swe = {f"{method} {dtype}": swe_deltasnow_array(
+           hs.astype(dtype), 24, interpolate_small_gaps=True,
+           interpolation_method=method, dtype=dtype).tolist()
+       for method in ["nearest", "zero", "next", "pchip"]
+       for dtype in ["float64", "float32"]}
+print(json.dumps([jit.BACKEND, "numba" in sys.modules, swe]))
+"""
+
+
+def _run_in_new_process(cache_dir):
+    env = dict(os.environ, PYDELTASNOW_CACHE_DIR=str(cache_dir))
+    out = subprocess.run(
+        [sys.executable, "-c", SCRIPT],
+        env=env,
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def test_kernels_are_loaded_from_cache(tmpdir):
+    first = _run_in_new_process(tmpdir)
+    # the engines are cached separately
+    for kernel in [KERNEL, KERNEL + "[fast]"]:
+        assert first[kernel]["cache_misses"] == 1
+        assert first[kernel]["cache_hits"] == 0
+        assert first[kernel]["cache_path"].startswith(str(tmpdir))
+    assert len(tmpdir.listdir()) > 0
+
+    second = _run_in_new_process(tmpdir)
+    for kernel in [KERNEL, KERNEL + "[fast]"]:
+        assert second[kernel]["cache_misses"] == 0
+        assert second[kernel]["cache_hits"] == 1
+    assert all(info["cache_misses"] == 0 for info in second.values())
+
+
+def test_gap_filler_is_compiled_ahead_of_time():
+    from pydeltasnow.aot import _argument_types
+
+    exported = [(name, float_type) for name, float_type, _ in _argument_types()]
+    for float_type in jit.FLOAT_TYPES:
+        assert ("pydeltasnow.utils._fill_small_gaps", float_type) in exported
+
+
+@pytest.mark.aot
+def test_gap_filler_with_aot_backend(aot_package):
+    def run(disable_aot):
+        env = dict(os.environ, PYTHONPATH=str(aot_package))
+        if disable_aot:
+            env[jit.DISABLE_AOT_ENV] = "1"
+        out = subprocess.run(
+            [sys.executable, "-c", GAP_SCRIPT], env=env,
+            capture_output=True, check=True, text=True).stdout
+        return json.loads(out.splitlines()[-1])
+
+    backend, numba_imported, swe_aot = run(disable_aot=False)
+    assert backend == "aot" and not numba_imported
+    backend, _, swe_jit = run(disable_aot=True)
+    assert backend == "jit"
+    assert swe_aot == swe_jit
+
+
+@pytest.mark.aot
+def test_stale_aot_module_is_ignored(aot_package, tmp_path):
+    script = "from pydeltasnow import jit; print(jit.BACKEND)"
+    shutil.copytree(aot_package / "pydeltasnow", tmp_path / "pydeltasnow")
+    env = dict(os.environ, PYTHONPATH=str(tmp_path))
+
+    def run():
+        return subprocess.run(
+            [sys.executable, "-W", "always", "-c", script], env=env,
+            capture_output=True, check=True, text=True)
+
+    out = run()
+    assert out.stdout.strip() == "aot"
+    assert "RuntimeWarning" not in out.stderr
+
+    # the source changes after the kernels were compiled
+    with open(tmp_path / "pydeltasnow" / "core.py", "a") as f:
+        f.write("\n# changed\n")
+    out = run()
+    assert out.stdout.strip() == "jit"
+    assert "ahead-of-time compiled kernels were built from another" in (
+        out.stderr)
+
+
+def test_warmup_compiles_all_declared_signatures(hs_5wj_as_series, model_params):
+    timings = pydeltasnow.warmup()
+    assert set(timings) == set(jit.SIGNATURES)
+    assert "pydeltasnow.core.deltasnow_snowpack_evolution" in timings
+    assert "pydeltasnow.utils.continuous_timedeltas" in timings
+    assert all(t >= 0 for t in timings.values())
+
+    n_signatures = {name: len(jit.KERNELS[name].signatures)
+                    for name in timings}
+    for dtype in ["float64", "float32"]:
+        swe_deltasnow(hs_5wj_as_series, ignore_zeropadded_gaps=True,
+                      interpolate_small_gaps=True, dtype=dtype)
+    Hobs = hs_5wj_as_series.fillna(0).to_numpy()
+    params = tuple(model_params.values())
+    swe_64 = deltasnow_snowpack_evolution(Hobs, *params, False, 0)
+    swe_32 = deltasnow_snowpack_evolution(
+        Hobs.astype(np.float32), *np.float32(params), False, 0)
+    np.testing.assert_allclose(swe_32, swe_64, atol=1e-3)
+    # nothing was compiled after the warmup
+    for name, n in n_signatures.items():
+        assert len(jit.KERNELS[name].signatures) == n
+
+
+def test_engine_kernel(model_params):
+    from pydeltasnow.core import _snowpack_evolution
+
+    assert jit.engine_kernel(deltasnow_snowpack_evolution, "reference") is (
+        deltasnow_snowpack_evolution)
+    fast = jit.engine_kernel(deltasnow_snowpack_evolution, "fast")
+    assert jit.engine_kernel(deltasnow_snowpack_evolution, "fast") is fast
+    name = "pydeltasnow.core.deltasnow_snowpack_evolution[fast]"
+    assert jit.KERNELS[name] is fast
+    # the kernels called by the fast kernel are fast as well
+    assert "pydeltasnow.core._snowpack_evolution[fast]" in jit.KERNELS
+    assert fast.py_func.__globals__["_snowpack_evolution"] is not (
+        _snowpack_evolution)
+
+    Hobs = np.array([0., 0.2, 0.3, 0.25, 0.1, 0.])
+    params = tuple(model_params.values())
+    np.testing.assert_allclose(
+        fast(Hobs, *params, False, 0),
+        deltasnow_snowpack_evolution(Hobs, *params, False, 0))
+    with pytest.raises(ValueError, match="engine"):
+        jit.engine_kernel(deltasnow_snowpack_evolution, "turbo")
@@ -7,101 +7,19 @@ nor rpy2 a test dependency of this package, I decided to run the calculation
 of the R model externally and provide the output as csv file in the
 `tests/data` directory. This directory holds input HS data and SWE data
 calculated with the nixmass R package respectively as well as scripts to get
-this data. The fixtures in this module load the HS and SWE data.
+this data. The fixtures in `conftest.py` load the HS and SWE data.
 """
-from distutils import dir_util
-import os
-from pathlib import Path
-
 import pytest
 import numpy as np
 import pandas as pd
 
-from pydeltasnow import swe_deltasnow
+from pydeltasnow import Workspace, max_layers_deviation, swe_deltasnow
 
 __author__ = "Johannes Aschauer"
 __copyright__ = "Johannes Aschauer"
 __license__ = "GPL-2.0-or-later"
 
 
-@pytest.fixture
-def datadir(tmpdir, request):
-    '''
-    Fixture responsible for searching a folder with the same name of test
-    module and, if available, moving all contents to a temporary directory so
-    tests can use them freely.
-
-    Adapted from: https://stackoverflow.com/a/29631801
-    '''
-    filename =  Path(request.module.__file__)
-    test_dir = filename.parent / "data"
-
-    if os.path.isdir(test_dir):
-        dir_util.copy_tree(test_dir, str(tmpdir))
-
-    return tmpdir
-
-
-@pytest.fixture
-def hs_5wj_as_series(datadir):
-    # HS in [m]
-    df = (pd.read_csv(datadir.join("hs_data_5WJ.csv"))
-          .loc[:, ["date", "hs"]]
-          .assign(date=lambda x: pd.to_datetime(x['date']))
-          .set_index('date')
-          .squeeze()
-          )
-    return df
-
-
-@pytest.fixture
-def hs_5df_as_series(datadir):
-    # HS in [m]
-    df = (pd.read_csv(datadir.join("hs_data_5DF.csv"))
-          .loc[:, ["date", "hs"]]
-          .assign(date=lambda x: pd.to_datetime(x['date']))
-          .set_index('date')
-          .squeeze()
-          )
-    return df
-
-
-@pytest.fixture
-def hs_1ad_as_series(datadir):
-    # HS in [m]
-    df = (pd.read_csv(datadir.join("hs_data_1AD.csv"))
-          .loc[:, ["date", "hs"]]
-          .assign(date=lambda x: pd.to_datetime(x['date']))
-          .set_index('date')
-          .squeeze()
-          )
-    return df
-
-
-@pytest.fixture
-def swe_5wj_as_series(datadir):
-    # SWE in [mm]
-    return pd.read_csv(datadir.join("swe_data_5WJ.csv"),
-                       parse_dates=['date'],
-                       index_col='date').squeeze()
-
-
-@pytest.fixture
-def swe_5df_as_series(datadir):
-    # SWE in [mm]
-    return pd.read_csv(datadir.join("swe_data_5DF.csv"),
-                       parse_dates=['date'],
-                       index_col='date').squeeze()
-
-
-@pytest.fixture
-def swe_1ad_as_series(datadir):
-    # SWE in [mm]
-    return pd.read_csv(datadir.join("swe_data_1AD.csv"),
-                       parse_dates=['date'],
-                       index_col='date').squeeze()
-
-
 @pytest.fixture
 def all_zeros_series():
     return pd.Series(data=np.zeros(1000),
@@ -130,6 +48,41 @@ def test_swe_deltasnow_against_nixmass(
                                    check_names=False)
 
 
+# bound of the deviation of the engines from nixmass in [mm] by dtype
+ENGINE_TOLERANCE = {"float64": 1e-6, "float32": 1e-3}
+
+
+@pytest.mark.parametrize(
+    "input_hs_data, nixmass_swe_data",
+    [
+        ("hs_5wj_as_series", "swe_5wj_as_series"),
+        ("hs_5df_as_series", "swe_5df_as_series"),
+        ("hs_1ad_as_series", "swe_1ad_as_series"),
+    ],
+)
+@pytest.mark.parametrize("engine", ["reference", "fast"])
+@pytest.mark.parametrize("dtype", ["float64", "float32"])
+def test_engines_against_nixmass(
+    input_hs_data,
+    nixmass_swe_data,
+    engine,
+    dtype,
+    request
+):
+    input_hs_data = request.getfixturevalue(input_hs_data)
+    nixmass_swe_data = request.getfixturevalue(nixmass_swe_data)
+    swe_pydeltasnow = swe_deltasnow(input_hs_data, engine=engine, dtype=dtype)
+    np.testing.assert_allclose(swe_pydeltasnow.to_numpy(),
+                               nixmass_swe_data.to_numpy(),
+                               rtol=0,
+                               atol=ENGINE_TOLERANCE[dtype])
+
+
+def test_invalid_engine(hs_5wj_as_series):
+    with pytest.raises(ValueError, match="engine"):
+        swe_deltasnow(hs_5wj_as_series, engine="turbo")
+
+
 @pytest.fixture
 def hs_5wj_with_zeropadded_gaps(hs_5wj_as_series):
     s = hs_5wj_as_series.copy()
@@ -244,3 +197,101 @@ def test_unit_conversion(
     pd.testing.assert_series_equal(swe_pydeltasnow,
                                    swe_data,
                                    check_names=False)
+
+
+def test_workspace_is_reused_between_calls(
+    hs_5wj_as_series,
+    hs_1ad_as_series,
+    swe_5wj_as_series,
+    swe_1ad_as_series,
+):
+    workspace = Workspace()
+    swe_5wj = swe_deltasnow(hs_5wj_as_series, workspace=workspace)
+    layers = workspace.layers
+    assert workspace.n_layers > 0
+
+    # same series again: no reallocation
+    swe_5wj_again = swe_deltasnow(hs_5wj_as_series, workspace=workspace)
+    assert workspace.layers is layers
+    pd.testing.assert_series_equal(swe_5wj, swe_5wj_again)
+    pd.testing.assert_series_equal(swe_5wj, swe_5wj_as_series, check_names=False)
+
+    # another station in the same workspace
+    swe_1ad = swe_deltasnow(hs_1ad_as_series, workspace=workspace)
+    pd.testing.assert_series_equal(swe_1ad, swe_1ad_as_series, check_names=False)
+
+
+@pytest.mark.parametrize(
+    "input_hs_data, nixmass_swe_data",
+    [
+        ("hs_5wj_as_series", "swe_5wj_as_series"),
+        ("hs_5df_as_series", "swe_5df_as_series"),
+        ("hs_1ad_as_series", "swe_1ad_as_series"),
+    ],
+)
+def test_coalesce_saturated_layers_against_nixmass(
+    input_hs_data,
+    nixmass_swe_data,
+    request
+):
+    input_hs_data = request.getfixturevalue(input_hs_data)
+    nixmass_swe_data = request.getfixturevalue(nixmass_swe_data)
+    swe_pydeltasnow = swe_deltasnow(input_hs_data,
+                                     coalesce_saturated_layers=True)
+    pd.testing.assert_series_equal(swe_pydeltasnow,
+                                   nixmass_swe_data,
+                                   check_names=False)
+
+
+@pytest.mark.parametrize(
+    "input_hs_data",
+    ["hs_5wj_as_series", "hs_5df_as_series", "hs_1ad_as_series"],
+)
+def test_max_layers_deviation(input_hs_data, request):
+    input_hs_data = request.getfixturevalue(input_hs_data)
+    swe_max = swe_deltasnow(input_hs_data).max()
+    # the bound is never reached, the result is exact
+    assert max_layers_deviation(input_hs_data, len(input_hs_data)) == 0.
+    # 20 layers deviate by less than 1% of the SWE maximum at all stations
+    deviation = max_layers_deviation(input_hs_data, 20)
+    assert 0. < deviation < 0.01 * swe_max
+    assert max_layers_deviation(input_hs_data, 5) > deviation
+
+
+def test_max_layers_deviation_invalid_kwargs(hs_5wj_as_series):
+    with pytest.raises(ValueError, match="out"):
+        max_layers_deviation(hs_5wj_as_series, 5,
+                             out=np.empty(len(hs_5wj_as_series)))
+    with pytest.raises(ValueError, match="return_diagnostics"):
+        max_layers_deviation(hs_5wj_as_series, 5, return_diagnostics=True)
+
+
+def test_max_layers_invalid(hs_5wj_as_series):
+    with pytest.raises(ValueError):
+        swe_deltasnow(hs_5wj_as_series, max_layers=0)
+    with pytest.raises(ValueError):
+        swe_deltasnow(hs_5wj_as_series, max_layers=10,
+                      coalesce_saturated_layers=True)
+
+
+def test_diagnostics(hs_5wj_as_series, capfd):
+    swe = swe_deltasnow(hs_5wj_as_series)
+    swe_diag, diagnostics = swe_deltasnow(hs_5wj_as_series,
+                                          return_diagnostics=True)
+    pd.testing.assert_series_equal(swe, swe_diag)
+    assert set(diagnostics) == {
+        "recompaction_error",
+        "scale_excess",
+        "scale_runoff",
+        "saturated_scaling",
+        "drench_runoff",
+        "max_layers_merge",
+    }
+    assert all(isinstance(n, int) and n >= 0 for n in diagnostics.values())
+    assert diagnostics["max_layers_merge"] == 0
+    # the kernel does not print anything
+    assert capfd.readouterr().out == ""
+
+    _, diagnostics = swe_deltasnow(hs_5wj_as_series, max_layers=5,
+                                   return_diagnostics=True)
+    assert diagnostics["max_layers_merge"] > 0
@@ -0,0 +1,209 @@
+"""
+Tests for the pandas-free interface in `pydeltasnow.model`.
+"""
+import pytest
+import numpy as np
+import pandas as pd
+
+from pydeltasnow import Workspace, swe_deltasnow
+from pydeltasnow.model import swe_deltasnow_array
+
+__author__ = "Johannes Aschauer"
+__copyright__ = "Johannes Aschauer"
+__license__ = "GPL-2.0-or-later"
+
+
+@pytest.mark.parametrize(
+    "input_hs_data",
+    ["hs_5wj_as_series", "hs_5df_as_series", "hs_1ad_as_series"],
+)
+def test_swe_deltasnow_array_against_series(input_hs_data, request):
+    hs = request.getfixturevalue(input_hs_data)
+    expected = swe_deltasnow(hs).to_numpy()
+
+    dates = hs.index.to_numpy()
+    swe = swe_deltasnow_array(hs.to_numpy(), dates)
+    assert isinstance(swe, np.ndarray)
+    np.testing.assert_array_equal(swe, expected)
+
+    epoch_seconds = dates.astype("datetime64[s]").astype(np.int64)
+    np.testing.assert_array_equal(
+        swe_deltasnow_array(hs.to_numpy(), epoch_seconds, timestamp_unit="s"),
+        expected)
+    np.testing.assert_array_equal(
+        swe_deltasnow_array(hs.to_numpy(), dates.astype(np.int64)),
+        expected)
+
+
+def test_swe_deltasnow_array_fixed_resolution(hs_5wj_as_series):
+    hs = hs_5wj_as_series.to_numpy()
+    np.testing.assert_array_equal(
+        swe_deltasnow_array(hs, 24),
+        swe_deltasnow_array(hs, hs_5wj_as_series.index.to_numpy()))
+
+
+def test_swe_deltasnow_array_mixed_resolution(
+        hs_5wj_as_series, hs_5df_as_series):
+    # daily observations followed by hourly observations
+    daily = hs_5wj_as_series
+    hourly = hs_5df_as_series.to_numpy()
+    assert daily.iloc[-1] == 0 and hourly[0] == 0
+    hourly_dates = (daily.index[-1] + pd.Timedelta(hours=1)
+                    + pd.to_timedelta(np.arange(len(hourly)), unit="h"))
+    hs = np.concatenate([daily.to_numpy(), hourly])
+    dates = np.concatenate([daily.index.to_numpy(), hourly_dates.to_numpy()])
+
+    expected = np.concatenate([
+        swe_deltasnow_array(daily.to_numpy(), 24),
+        swe_deltasnow_array(hourly, 1),
+    ])
+    np.testing.assert_array_equal(swe_deltasnow_array(hs, dates), expected)
+    np.testing.assert_array_equal(
+        swe_deltasnow(pd.Series(hs, index=dates)).to_numpy(), expected)
+
+
+@pytest.mark.parametrize("hs_input_unit", ["m", "cm"])
+def test_split_seasons_at_gaps(hs_5wj_as_series, hs_input_unit):
+    hs = hs_5wj_as_series.to_numpy()
+    if hs_input_unit == "cm":
+        hs = hs * 100
+    dates = hs_5wj_as_series.index.to_numpy()
+    start, stop = np.flatnonzero(hs > 0)[[20, 40]]
+    hs_gap = hs.copy()
+    hs_gap[start:stop] = np.nan
+    with pytest.raises(ValueError, match="NaN"):
+        swe_deltasnow_array(hs_gap, dates, hs_input_unit=hs_input_unit)
+
+    # the snowpack after the gap starts like after a zero
+    restarted = hs.copy()
+    restarted[start:stop] = 0
+    expected = swe_deltasnow_array(
+        restarted, dates, hs_input_unit=hs_input_unit)
+    expected[start:stop] = np.nan
+    np.testing.assert_array_equal(
+        swe_deltasnow_array(hs_gap, dates, hs_input_unit=hs_input_unit,
+                            split_seasons_at_gaps=True),
+        expected)
+    np.testing.assert_array_equal(
+        swe_deltasnow(pd.Series(hs_gap, index=dates),
+                      hs_input_unit=hs_input_unit,
+                      split_seasons_at_gaps=True).to_numpy(),
+        expected)
+
+
+def test_swe_deltasnow_array_invalid_dates(hs_5wj_as_series):
+    hs = hs_5wj_as_series.to_numpy()
+    with pytest.raises(ValueError, match="same length"):
+        swe_deltasnow_array(hs, hs_5wj_as_series.index.to_numpy()[1:])
+    with pytest.raises(ValueError, match="datetime64"):
+        swe_deltasnow_array(hs, np.ones(len(hs)))
+    with pytest.raises(ValueError, match="one-dimensional"):
+        swe_deltasnow_array(hs[None, :], 24)
+
+
+@pytest.mark.parametrize("method", ["nearest", "previous", "next"])
+def test_interpolation_methods(hs_5wj_as_series, method):
+    hs = hs_5wj_as_series.to_numpy()
+    gap = np.flatnonzero(hs > 0)[10:12]
+    filled = hs.copy()
+    filled[gap] = {
+        "nearest": [hs[gap[0]-1], hs[gap[1]+1]],
+        "previous": [hs[gap[0]-1]] * 2,
+        "next": [hs[gap[1]+1]] * 2,
+    }[method]
+    hs[gap] = np.nan
+    np.testing.assert_array_equal(
+        swe_deltasnow_array(hs, 24, interpolate_small_gaps=True,
+                            interpolation_method=method),
+        swe_deltasnow_array(filled, 24))
+
+
+@pytest.mark.parametrize(
+    "input_hs_data",
+    ["hs_5wj_as_series", "hs_5df_as_series", "hs_1ad_as_series"],
+)
+@pytest.mark.parametrize("coalesce", [False, True])
+def test_float32_deviation(input_hs_data, coalesce, request):
+    hs = request.getfixturevalue(input_hs_data)
+    dates = hs.index.to_numpy()
+    swe64 = swe_deltasnow_array(hs.to_numpy(), dates,
+                                coalesce_saturated_layers=coalesce)
+    swe32 = swe_deltasnow_array(hs.to_numpy(), dates, dtype="float32",
+                                coalesce_saturated_layers=coalesce)
+    assert swe32.dtype == np.float32
+    # SWE in mm, the float32 rounding error of 1000 mm is 6e-5 mm
+    np.testing.assert_allclose(swe32, swe64, rtol=0, atol=1e-3)
+
+
+def test_float32_workspace(hs_5wj_as_series):
+    hs = hs_5wj_as_series.to_numpy()
+    workspace = Workspace(dtype=np.float32)
+    swe = swe_deltasnow_array(hs, 24, dtype=np.float32, workspace=workspace)
+    assert workspace.layers.dtype == np.float32
+    np.testing.assert_array_equal(
+        swe, swe_deltasnow_array(hs, 24, dtype=np.float32))
+
+    with pytest.raises(ValueError, match="workspace dtype"):
+        swe_deltasnow_array(hs, 24, workspace=workspace)
+    with pytest.raises(ValueError, match="dtype"):
+        swe_deltasnow_array(hs, 24, dtype=np.float16)
+
+
+def test_out(hs_5wj_as_series):
+    hs = hs_5wj_as_series.to_numpy()
+    dates = hs_5wj_as_series.index.to_numpy()
+    matrix = np.full((3, len(hs)), -1.)
+    swe = swe_deltasnow_array(hs * 100, dates, hs_input_unit="cm",
+                              swe_output_unit="m", out=matrix[1])
+    assert swe is matrix[1] or np.shares_memory(swe, matrix)
+    np.testing.assert_allclose(
+        matrix[1], swe_deltasnow_array(hs, dates) / 1000, rtol=1e-12)
+    assert np.all(matrix[[0, 2]] == -1.)
+
+    with pytest.raises(ValueError, match="out"):
+        swe_deltasnow_array(hs, dates, out=matrix[:, 0])
+    with pytest.raises(ValueError, match="out"):
+        swe_deltasnow_array(hs, dates, out=np.zeros(len(hs), np.float32))
+
+
+def test_input_is_not_modified(hs_5wj_as_series):
+    hs = hs_5wj_as_series.to_numpy().copy()
+    hs[374:398] = np.nan
+    original = hs.copy()
+    swe = swe_deltasnow_array(hs, hs_5wj_as_series.index.to_numpy(),
+                              ignore_zeropadded_gaps=True)
+    np.testing.assert_array_equal(hs, original)
+    assert np.all(np.isnan(swe[374:398]))
+
+
+def _peak_memory(func, *args, **kwargs):
+    tracemalloc = pytest.importorskip("tracemalloc")
+    func(*args, **kwargs)
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+@pytest.mark.parametrize("interpolate_small_gaps", [False, True])
+def test_peak_memory(hs_5wj_as_series, interpolate_small_gaps):
+    # units are converted in the kernel, no full length temporaries apart
+    # from boolean masks are needed. Without NaNs, hs is not copied for the
+    # gap filling.
+    hs = np.tile(hs_5wj_as_series.fillna(0).to_numpy() * 100, 20)
+    peak = _peak_memory(
+        swe_deltasnow_array, hs, 24, hs_input_unit="cm", swe_output_unit="m",
+        interpolate_small_gaps=interpolate_small_gaps)
+    assert peak < 1.5 * hs.nbytes
+
+
+def test_float32_peak_memory(hs_5wj_as_series):
+    # float32 only saves memory, the arithmetic is still done in float64
+    hs = np.tile(hs_5wj_as_series.fillna(0).to_numpy(), 20)
+    peak_64 = _peak_memory(swe_deltasnow_array, hs, 24)
+    peak_32 = _peak_memory(
+        swe_deltasnow_array, hs.astype(np.float32), 24, dtype=np.float32)
+    assert peak_32 < 0.6 * peak_64
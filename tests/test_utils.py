@@ -3,10 +3,20 @@ import numpy as np
 import pandas as pd
 
 from pydeltasnow.utils import (
+    DATES_ERROR,
+    NAN_ERROR,
+    NEGATIVE_ERROR,
+    ONE_HOUR,
+    START_ERROR,
     continuous_timedeltas,
+    continuous_timedeltas_in_nonzero_chunks,
+    date_steps,
+    fill_small_gaps,
     get_nonzero_chunk_idxs,
     get_small_gap_idxs,
     get_zeropadded_gap_idxs,
+    preprocess,
+    regularize,
     )
 
 __author__ = "Johannes Aschauer"
@@ -53,6 +63,30 @@ def test_continuous_timedeltas(
     assert resolution == resolution_expected
 
 
+def test_date_steps(dates_incontinuous_one_day):
+    day = 24 * 3600 * 10**9
+    np.testing.assert_array_equal(
+        date_steps(dates_incontinuous_one_day),
+        np.array([day, day, day, 3*day, day, day, day, day]),
+    )
+    assert date_steps(dates_incontinuous_one_day).dtype == np.int64
+    assert len(date_steps(dates_incontinuous_one_day[:1])) == 0
+
+
+def test_continuous_timedeltas_in_nonzero_chunks(dates_incontinuous_one_day):
+    dates = dates_incontinuous_one_day
+    # the jump in the dates is between two chunks
+    assert continuous_timedeltas_in_nonzero_chunks(
+        dates, np.array([0, 4]), np.array([4, 9])) == (True, 24)
+    # the jump is within a chunk
+    assert not continuous_timedeltas_in_nonzero_chunks(
+        dates, np.array([0, 5]), np.array([5, 9]))[0]
+    # chunks with different resolutions
+    dates = np.concatenate([dates[:4], dates[3] + np.arange(1, 6) * ONE_HOUR])
+    assert not continuous_timedeltas_in_nonzero_chunks(
+        dates, np.array([0, 3]), np.array([4, 9]))[0]
+
+
 @pytest.mark.parametrize(
     "sample, start_expected, stop_expected",
     [
@@ -61,10 +95,12 @@ def test_continuous_timedeltas(
         (np.array([0,0,0,1,1,1]), np.array([2]), np.array([6])),
         (np.array([0,1,0,3,4,0,6,0,0,9,0]), np.array([0,2,5,8]), np.array([2,5,7,10])),
         (np.zeros(10), np.array([]), np.array([])),
+        (np.array([np.nan,0,np.nan]), np.array([0,1]), np.array([1,3])),
     ],
 )
 def test_get_nonzero_chunk_idxs(sample, start_expected, stop_expected):
-    start_out, stop_out = get_nonzero_chunk_idxs(sample)
+    start_out, stop_out = get_nonzero_chunk_idxs(sample.astype(float))
+    assert start_out.dtype == np.int64 and stop_out.dtype == np.int64
     np.testing.assert_array_equal(start_out, start_expected)
     np.testing.assert_array_equal(stop_out, stop_expected)
 
@@ -306,3 +342,187 @@ def test_get_small_gap_idxs():
         get_small_gap_idxs(hs_in, dates_in, 5),
         np.array([False,False,False,False])
         )
+
+
+@pytest.mark.parametrize(
+    "method, filled_expected",
+    [
+        ("linear", [1, 2, 3, 4, 5]),
+        ("nearest", [1, 1, 1, 5, 5]),
+        ("zero", [1, 1, 1, 1, 5]),
+        ("previous", [1, 1, 1, 1, 5]),
+        ("next", [1, 5, 5, 5, 5]),
+    ],
+)
+def test_fill_small_gaps(method, filled_expected):
+    hs_in = np.array([1, np.nan, np.nan, np.nan, 5, np.nan, np.nan, 0])
+    dates_in = pd.date_range(start='2000-01-01', periods=8, freq='D').to_numpy()
+    dates_in[6:] = dates_in[6:] + np.timedelta64(1, "D")
+    # the second gap is not continuous in time
+    np.testing.assert_array_equal(
+        fill_small_gaps(hs_in, dates_in, 3, method),
+        np.array(filled_expected + [np.nan, np.nan, 0]),
+    )
+
+
+@pytest.mark.parametrize("method", ["linear", "nearest", "zero", "pchip"])
+def test_fill_small_gaps_equals_pandas(method):
+    pytest.importorskip("scipy")
+    hs, dates = _random_series(0)
+    valid_gap_mask = get_small_gap_idxs(hs, dates, 3)
+    assert valid_gap_mask.sum() > 10
+    expected = np.where(
+        valid_gap_mask,
+        pd.Series(hs).interpolate(method=method).to_numpy(),
+        hs)
+    np.testing.assert_allclose(
+        fill_small_gaps(hs, dates, 3, method), expected, rtol=1e-12)
+
+
+def _random_series(seed, n=400):
+    """Snow depth with seasons, gaps of NaNs and some irregular dates."""
+    rng = np.random.default_rng(seed)
+    hs = np.where(np.sin(np.arange(n) / 15.) > 0.3, rng.random(n), 0.)
+    hs[0] = 0.
+    for _ in range(12):
+        start = rng.integers(1, n)
+        hs[start:start + rng.integers(1, 6)] = np.nan
+    steps = np.full(n - 1, 3600 * 10**9)
+    steps[rng.integers(0, n - 1, size=2)] = 2 * 3600 * 10**9
+    dates = np.concatenate([[0], np.cumsum(steps)]).astype("datetime64[ns]")
+    return hs, dates
+
+
+def _stepwise_preprocess(hs, dates, ignore_gaps, require_leading_zero, fill,
+                         max_gap_length):
+    """The individual steps that preprocess combines."""
+    gap_mask = np.zeros(len(hs), dtype=bool)
+    if ignore_gaps:
+        gap_mask = get_zeropadded_gap_idxs(hs, require_leading_zero)
+        hs = np.where(gap_mask, 0., hs)
+    if fill and np.any(np.isnan(hs)):
+        hs = fill_small_gaps(hs, dates, max_gap_length)
+    start_idxs, stop_idxs = get_nonzero_chunk_idxs(hs)
+    return hs, gap_mask, start_idxs, stop_idxs
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("ignore_gaps, require_leading_zero",
+                         [(False, True), (True, True), (True, False)])
+@pytest.mark.parametrize("fill", [False, True])
+def test_preprocess_equals_stepwise(seed, ignore_gaps, require_leading_zero,
+                                    fill):
+    hs, dates = _random_series(seed)
+    expected, gap_mask, start_idxs, stop_idxs = _stepwise_preprocess(
+        hs, dates, ignore_gaps, require_leading_zero, fill, 3)
+
+    filled = hs.copy()
+    seasons, gaps, errors = preprocess(
+        filled, dates.view(np.int64), 0, ignore_gaps, require_leading_zero,
+        fill, 3)
+
+    mask = np.zeros(len(hs), dtype=bool)
+    for start, stop in gaps:
+        mask[start:stop] = True
+    np.testing.assert_array_equal(mask, gap_mask)
+    np.testing.assert_array_equal(np.where(mask, 0., filled), expected)
+    np.testing.assert_array_equal(seasons[:, 0], start_idxs)
+    np.testing.assert_array_equal(seasons[:, 1], stop_idxs)
+    assert bool(errors & NAN_ERROR) == np.any(np.isnan(expected))
+    assert not errors & (NEGATIVE_ERROR | START_ERROR)
+    # the seasons can have different resolutions
+    continuous = True
+    for start, stop, step in seasons:
+        season_continuous, resolution = continuous_timedeltas(
+            dates[start:stop])
+        continuous = continuous and season_continuous
+        assert step / 3600e9 == resolution
+    assert bool(errors & DATES_ERROR) != continuous
+
+
+def test_preprocess_errors():
+    no_dates = np.zeros(0, dtype=np.int64)
+    day = 24 * 3600 * 10**9
+    seasons, gaps, errors = preprocess(
+        np.array([0., 1., 2., 0., 0., 3., 0.]), no_dates, day, False, True,
+        False, 3)
+    np.testing.assert_array_equal(
+        seasons, [[0, 3, day], [4, 6, day]])
+    assert len(gaps) == 0 and errors == 0
+
+    assert preprocess(np.array([1., 0.]), no_dates, day, False, True,
+                      False, 3)[2] == START_ERROR
+    assert preprocess(np.array([0., -1., 0.]), no_dates, day, False, True,
+                      False, 3)[2] == NEGATIVE_ERROR
+    assert preprocess(np.array([0., np.nan, 1., 0.]), no_dates, day, True,
+                      True, False, 3)[2] == NAN_ERROR
+    dates = np.array([0, 1, 2, 4, 5, 6]) * day
+    assert preprocess(np.array([0., 1., 1., 1., 0., 0.]), dates, 0, False,
+                      True, False, 3)[2] == DATES_ERROR
+    # different timesteps of the seasons
+    dates = np.array([0, 1, 2, 3, 5, 7, 9]) * day
+    seasons, gaps, errors = preprocess(
+        np.array([0., 1., 0., 0., 1., 1., 0.]), dates, 0, False, True,
+        False, 3)
+    np.testing.assert_array_equal(
+        seasons, [[0, 2, day], [3, 6, 2*day]])
+    assert errors == 0
+
+
+def test_preprocess_split_seasons():
+    no_dates = np.zeros(0, dtype=np.int64)
+    hs = np.array([0., 1., 2., np.nan, np.nan, 3., 1., 0., np.nan, 1., 0.])
+    assert preprocess(hs.copy(), no_dates, 1, False, True, False, 3)[2] \
+        == NAN_ERROR
+    seasons, gaps, errors = preprocess(
+        hs.copy(), no_dates, 1, False, True, False, 3, True)
+    # the seasons after the gaps start at the last NaN of the gap
+    np.testing.assert_array_equal(
+        seasons, [[0, 3, 1], [4, 7, 1], [8, 10, 1]])
+    np.testing.assert_array_equal(gaps, [[3, 5], [8, 9]])
+    assert errors == 0
+
+    # small gaps are still filled
+    seasons, gaps, errors = preprocess(
+        hs, no_dates, 1, False, True, True, 1, True)
+    np.testing.assert_array_equal(
+        seasons, [[0, 3, 1], [4, 7, 1], [7, 10, 1]])
+    np.testing.assert_array_equal(gaps, [[3, 5]])
+    assert hs[8] == 0.5 and errors == 0
+
+
+def test_regularize():
+    hour = np.timedelta64(1, "h")
+    start = np.datetime64("2000-01-01T00:00", "ns")
+    dates = start + np.array([0, 1, 1, 2, 4, 5]) * hour
+    # jitter, duplicates, a NaN duplicate and a missing timestep
+    dates = dates + np.array([0, -5, 10, 20, 0, 0]).astype("timedelta64[m]")
+    hs = np.array([0., 1., 2., np.nan, 3., 0.])
+    hs_out, dates_out = regularize(hs[::-1], dates[::-1], 1)
+    np.testing.assert_array_equal(hs_out, [0., 1.5, np.nan, np.nan, 3., 0.])
+    np.testing.assert_array_equal(dates_out, start + np.arange(6) * hour)
+
+    with pytest.raises(ValueError, match="same length"):
+        regularize(hs, dates[1:], 1)
+    with pytest.raises(ValueError, match="positive"):
+        regularize(hs, dates, 0)
+    dates_nat = dates.copy()
+    dates_nat[2] = np.datetime64("NaT")
+    with pytest.raises(ValueError, match="NaT"):
+        regularize(hs, dates_nat, 1)
+    with pytest.raises(ValueError, match="NaT"):
+        regularize(hs, pd.DatetimeIndex(dates_nat), 1)
+
+
+def test_regularize_equals_pandas():
+    rng = np.random.default_rng(0)
+    n = 1000
+    dates = (np.datetime64("2000-01-01", "ns") + np.arange(n) * ONE_HOUR
+             + rng.integers(-20, 20, n).astype("timedelta64[m]"))
+    hs = rng.random(n)
+    hs[::13] = np.nan
+    expected = (pd.Series(hs, index=pd.DatetimeIndex(dates).round("h"))
+                .resample("h").mean())
+    hs_out, dates_out = regularize(hs, dates, 1)
+    np.testing.assert_allclose(hs_out, expected.to_numpy(), rtol=1e-15)
+    np.testing.assert_array_equal(dates_out, expected.index.to_numpy())